@@ -4,6 +4,10 @@
 LAC Database Safe - SQLite WAL cache layer.
 Read-only cache — JSON is always primary storage.
 Thread-safe: per-thread connections, no shared state.
+
+Durability tradeoff: WAL + synchronous=NORMAL never corrupts the database,
+but a power loss can drop the last committed transaction. That is fine for
+a cache — the missing blocks are re-synced from JSON on the next save.
 """
 import sqlite3
 import threading
@@ -29,9 +33,13 @@ class LACDatabaseSafe:
     def _get_conn(self):
         if not hasattr(self._local, 'conn') or self._local.conn is None:
             conn = sqlite3.connect(self.db_path, timeout=10)
-            conn.execute("PRAGMA journal_mode=WAL")
-            conn.execute("PRAGMA synchronous=NORMAL")
-            conn.execute("PRAGMA cache_size=10000")
+            conn.executescript("""
+                PRAGMA journal_mode=WAL;
+                PRAGMA synchronous=NORMAL;
+                PRAGMA temp_store=MEMORY;
+                PRAGMA mmap_size=268435456;
+                PRAGMA cache_size=-64000;
+            """)
             conn.row_factory = sqlite3.Row
             self._local.conn = conn
         return self._local.conn
@@ -78,20 +86,28 @@ class LACDatabaseSafe:
         """Sync blocks into SQLite cache. Safe to call from any thread."""
         if not self.enabled:
             return
+        current_height = self.get_height()
+        new_blocks = [b for b in chain if b.get('index', 0) > current_height]
+        if new_blocks:
+            self.sync_blocks(new_blocks, show_progress=show_progress)
+
+    def sync_blocks(self, blocks: list, show_progress: bool = False) -> bool:
+        """
+        Write the given blocks (and their transactions) into the cache.
+        No height scan — callers pass only what is new. Safe to call from any thread.
+        Returns True when everything was committed.
+        """
+        if not self.enabled:
+            return False
         try:
             import json
             conn = self._get_conn()
-            current_height = self.get_height()
-            new_blocks = [b for b in chain if b.get('index', 0) > current_height]
-
-            if not new_blocks:
-                return
 
-            total = len(new_blocks)
+            total = len(blocks)
             batch = []
             tx_batch = []
 
-            for i, block in enumerate(new_blocks):
+            for i, block in enumerate(blocks):
                 height = block.get('index', 0)
                 batch.append((
                     height,
@@ -114,7 +130,7 @@ class LACDatabaseSafe:
                             json.dumps(tx)
                         ))
 
-                # Write in batches of 500
+                # Write in batches of 500 — one transaction, one commit (fsync) at the end
                 if len(batch) >= 500:
                     conn.executemany(
                         "INSERT OR REPLACE INTO blocks(height,hash,timestamp,data) VALUES(?,?,?,?)",
@@ -125,7 +141,6 @@ class LACDatabaseSafe:
                             "INSERT OR REPLACE INTO transactions(tx_hash,block_height,sender,recipient,amount,timestamp,data) VALUES(?,?,?,?,?,?,?)",
                             tx_batch
                         )
-                    conn.commit()
                     batch.clear()
                     tx_batch.clear()
                     if show_progress and total > 1000:
@@ -146,13 +161,15 @@ class LACDatabaseSafe:
 
             if show_progress:
                 logger.info(f"[SQLite] Synced {total} new blocks")
+            return True
 
         except Exception as e:
-            logger.warning(f"[SQLite] sync_from_json error (non-fatal): {e}")
+            logger.warning(f"[SQLite] sync_blocks error (non-fatal): {e}")
             try:
                 self._local.conn = None  # Reset connection on error
             except Exception:
                 pass
+            return False
 
     def get_block(self, height: int) -> dict:
         if not self.enabled:
@@ -9,16 +9,25 @@ except ImportError:
 LAC Node - SECURED VERSION + FIXED ENDPOINTS
 Анонімність + Захист від атак + Всі API endpoints
 """
-import json, time, hashlib, secrets, os, sys
+import json, time, hashlib, secrets, os, sys, heapq, traceback
 from typing import Optional
 from pathlib import Path
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response
 from flask_cors import CORS
 from threading import RLock, Thread, Lock
-from collections import defaultdict
+from collections import defaultdict, Counter
 from datetime import datetime, timedelta
 import mimetypes
 import uuid as _uuid
+import re as _re
+
+# Optional fast JSON encoder (C/SIMD) — stdlib json fallback
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    orjson = None
+    ORJSON_AVAILABLE = False
 
 # Fix emoji display on Windows
 import io
@@ -54,6 +63,7 @@ try:
     from lac_stability import (
         setup_logging,
         StateManager,
+        ChainStore,
         retry_on_failure,
         GracefulShutdown,
         HealthMonitor,
@@ -172,6 +182,7 @@ except ImportError as e:
     POET_ENABLED = False
     print(f"⚠️ PoET Mining disabled: {e}")
     sys.stdout.flush()
+MINING_STATE_FILE = 'mining_state.bin'  # PoET win history (binary, node-local)
 
 
 # Import Zero-History Manager (PHASE 2B)
@@ -214,7 +225,6 @@ try:
 except Exception as e:
     WEBSOCKET_AVAILABLE = False
     print(f"WARNING: WebSocket failed to load: {e}")
-    import traceback
     traceback.print_exc()
     sys.stdout.flush()
 
@@ -295,6 +305,42 @@ def ws_push_to_peers(addr_list, event, data):
         ws_push(addr, event, data)
 
 # ===================== STATE =====================
+class KeyImageSet:
+    """
+    Spent key images held as raw bytes — a 32-byte value costs about half
+    of its 64-char hex str. Takes and yields hex strings, so callers and
+    key_images.json persistence stay unchanged. Wraps a set rather than
+    subclassing it, so no inherited method (update, |=, copy...) can
+    bypass the hex → bytes conversion.
+    """
+    __slots__ = ('_set',)
+
+    @staticmethod
+    def _raw(ki):
+        try:
+            return bytes.fromhex(ki)
+        except (ValueError, TypeError):
+            return ki  # non-hex key image — keep as-is
+
+    def __init__(self, items=()):
+        self._set = set(map(self._raw, items))
+
+    def add(self, ki):
+        self._set.add(self._raw(ki))
+
+    def discard(self, ki):
+        self._set.discard(self._raw(ki))
+
+    def __contains__(self, ki):
+        return self._raw(ki) in self._set
+
+    def __iter__(self):
+        for ki in self._set:
+            yield ki.hex() if isinstance(ki, bytes) else ki
+
+    def __len__(self):
+        return len(self._set)
+
 class State:
     def __init__(self, datadir):
         self.datadir = Path(datadir)
@@ -309,8 +355,9 @@ class State:
         self.groups = {}  # gid → {name, posts: [{from, text, ts}]}
         self.contacts = {}  # address → [contact_addresses]
         self.reactions = {}  # msg_key → {emoji: [addr1, addr2]}
-        self.referrals = {}  # invite_code → {creator, used_by: [], created_at}
+        self.referrals = {}  # invite_code → {creator, used_by: set(), created_at}
         self.referral_map = {}  # addr → {invite_code, invited_by, boost_burned}
+        self.referral_owner = {}  # invite_code → addr (reverse of referral_map, rebuilt on load)
         # Real-time counters (accumulated, never recalculated)
         self.counters = {
             'emitted_mining': 0,
@@ -324,16 +371,18 @@ class State:
             'burned_dms': 0,
             'burned_other': 0,
         }
-        self.spent_key_images = set()  # Ring signature key images
+        self.spent_key_images = KeyImageSet()  # Ring signature key images
         self.mempool = []
         
         # STASH Pool (blockchain-native anonymous mixing)
         self.stash_pool = {
             'total_balance': 0,
             'deposits': {},       # nullifier_hash → {amount, nominal, timestamp}
-            'spent_nullifiers': [] # list of spent nullifiers (prevent double-spend)
+            'spent_nullifiers': set()  # spent nullifiers (prevent double-spend)
         }
         self.rate_limits = {}  # identifier → [timestamps] for rate limiting
+        # Wallet aggregates for /api/stats, kept in step at mutation sites (rebuilt on load)
+        self.agg = {'level_counts': Counter(), 'dice_games': 0, 'dms_active': 0, 'username_burn': 0}
         
         # Mining coordinator
         self.mining_coordinator = None
@@ -378,12 +427,16 @@ class State:
         
         self.lock = RLock()  # RLock allows re-entry from same thread
         self._cache = {}   # in-memory cache: key -> (data, expires_at)
+        self._stats_cache = _new_stats_cache()  # /api/stats chain aggregates, folded per new block
+        self._counters_active = False  # sticky: set once any counter has recorded activity
         
         # Stability: StateManager for atomic writes
         if STABILITY_ENABLED:
             self.state_manager = StateManager(str(self.datadir))
+            self.chain_store = ChainStore(str(self.datadir))  # append-only chain.ndjson + chain.idx
         else:
             self.state_manager = None
+            self.chain_store = None
         self.load()
         
         # SQLite sync (SAFE - runs after load)
@@ -396,10 +449,19 @@ class State:
     def load(self):
         # Atomic loading with backup recovery
         if STABILITY_ENABLED and self.state_manager:
+            # No fallback to [] here: the next background flush would overwrite
+            # chain.ndjson with an empty chain. chain.json is not kept up to date
+            # after migration, so it is no fallback either — refuse to start.
             try:
-                self.chain = self.state_manager.load_with_backup('chain.json') or []
-            except:
-                self.chain = []
+                self.chain = self.chain_store.load()
+                if self.chain is None:
+                    # First start on NDJSON storage — migrate legacy chain.json once
+                    self.chain = self.state_manager.load_with_backup('chain.json') or []
+                    if self.chain:
+                        self.chain_store.rewrite(self.chain)
+                        print(f"✅ Migrated chain.json → chain.ndjson ({len(self.chain)} blocks)")
+            except Exception as e:
+                raise RuntimeError(f"Cannot load chain from {self.datadir}: {e}") from e
             try:
                 self.wallets = self.state_manager.load_with_backup('wallets.json') or {}
             except:
@@ -410,9 +472,9 @@ class State:
                 self.groups = {}
             try:
                 key_images_list = self.state_manager.load_with_backup('key_images.json') or []
-                self.spent_key_images = set(key_images_list)
+                self.spent_key_images = KeyImageSet(key_images_list)
             except:
-                self.spent_key_images = set()
+                self.spent_key_images = KeyImageSet()
             try:
                 stash_data = self.state_manager.load_with_backup('stash_pool.json')
                 if stash_data:
@@ -461,9 +523,9 @@ class State:
             kif = self.datadir / 'key_images.json'
             if kif.exists():
                 with open(kif) as f:
-                    self.spent_key_images = set(json.load(f))
+                    self.spent_key_images = KeyImageSet(json.load(f))
             else:
-                self.spent_key_images = set()
+                self.spent_key_images = KeyImageSet()
             spf = self.datadir / 'stash_pool.json'
             if spf.exists():
                 with open(spf) as f:
@@ -480,6 +542,17 @@ class State:
                 except:
                     self.reactions = {}
         
+        # used_by: list on disk → set in memory (O(1) "already used" check)
+        for r in self.referrals.values():
+            r['used_by'] = set(r.get('used_by', []))
+        
+        # Reverse index invite_code → owner address (O(1) referrer lookup)
+        self.referral_owner = {rm['invite_code']: a for a, rm in self.referral_map.items()
+                               if rm.get('invite_code')}
+        
+        # STASH nullifiers: list on disk → set in memory (O(1) double-spend check)
+        self.stash_pool['spent_nullifiers'] = set(self.stash_pool.get('spent_nullifiers', []))
+        
         # Load usernames (persist independently from blockchain — survives Zero-History)
         if STABILITY_ENABLED and self.state_manager:
             try:
@@ -568,6 +641,19 @@ class State:
         
         # Register Zero-History validators (AFTER wallets loaded!)
         self._register_zero_history_validators()
+        
+        # Wallet aggregates for /api/stats (kept in step by set_level & co.)
+        self.rebuild_agg()
+    
+    def rebuild_agg(self):
+        """Full wallet scan → self.agg. Level 0 is implied: len(wallets) - sum(level_counts)"""
+        wallets = self.wallets.values()
+        self.agg = {
+            'level_counts': Counter(lv for lv in (w.get('level', 0) for w in wallets) if lv),
+            'dice_games': sum(len(w.get('dice_history', ())) for w in wallets),
+            'dms_active': sum(1 for w in wallets if _dms_enabled(w)),
+            'username_burn': sum(_username_cost(w.get('username', '')) for w in wallets),
+        }
     
     def _register_zero_history_validators(self):
         """Register L5/L6 validators for Zero-History Phase 2B"""
@@ -642,42 +728,64 @@ class State:
             print(f"⚠️ No validators registered! Need L5/L6 wallets with sufficient balance")
             sys.stdout.flush()
     
-    def save(self):
-        """Non-blocking save — queues work to background thread"""
+    def mark_dirty(self):
+        """Flag state for the coalescing background flush (see _bg_save_worker)"""
         _schedule_save()
 
+    def save(self):
+        """Non-blocking save — same as mark_dirty(), kept for existing callers/plugins"""
+        self.mark_dirty()
+
     def save_sync(self):
         """Blocking save — only use when absolutely needed (shutdown)"""
         if STABILITY_ENABLED and self.state_manager:
-            # Atomic writes - zero data loss
-            self.state_manager.save_atomic('chain.json', self.chain)
-            self.state_manager.save_atomic('wallets.json', self.wallets)
-            self.state_manager.save_atomic('usernames.json', self.usernames)
-            self.state_manager.save_atomic('groups.json', self.groups)
-            self.state_manager.save_atomic('key_images.json', list(self.spent_key_images))
-            self.state_manager.save_atomic('stash_pool.json', self.stash_pool)
-            self.state_manager.save_atomic('persistent_msgs.json', self.persistent_msgs)
-            self.state_manager.save_atomic('referrals.json', {'codes': self.referrals, 'map': self.referral_map})
-            self.state_manager.save_atomic('counters.json', self.counters)
-            self.state_manager.save_atomic('reactions.json', self.reactions)
+            # Atomic writes - zero data loss; chain is append-only (new blocks only)
+            # One batch: fdatasync per file, a single directory fsync at the end
+            with self.state_manager.save_batch():
+                self.chain_store.flush_new(self.chain)
+                self.state_manager.save_atomic('wallets.json', self.wallets)
+                self.state_manager.save_atomic('usernames.json', self.usernames)
+                self.state_manager.save_atomic('groups.json', self.groups)
+                self.state_manager.save_atomic('key_images.json', list(self.spent_key_images))
+                self.state_manager.save_atomic('stash_pool.json', self._stash_pool_json())
+                self.state_manager.save_atomic('persistent_msgs.json', self.persistent_msgs)
+                self.state_manager.save_atomic('referrals.json', self._referrals_json())
+                self.state_manager.save_atomic('counters.json', self.counters)
+                self.state_manager.save_atomic('reactions.json', self.reactions)
         else:
             # Fallback
-            with open(self.datadir / 'chain.json', 'w') as f:
-                json.dump(self.chain, f, indent=2)
-            with open(self.datadir / 'wallets.json', 'w') as f:
-                json.dump(self.wallets, f, indent=2)
-            with open(self.datadir / 'usernames.json', 'w') as f:
-                json.dump(self.usernames, f, indent=2)
-            with open(self.datadir / 'groups.json', 'w') as f:
-                json.dump(self.groups, f, indent=2)
-            with open(self.datadir / 'key_images.json', 'w') as f:
-                json.dump(list(self.spent_key_images), f, indent=2)
-            with open(self.datadir / 'stash_pool.json', 'w') as f:
-                json.dump(self.stash_pool, f, indent=2)
-            with open(self.datadir / 'persistent_msgs.json', 'w') as f:
-                json.dump(self.persistent_msgs, f, indent=2)
-            with open(self.datadir / 'reactions.json', 'w') as f:
-                json.dump(self.reactions, f)
+            self._write_json('chain.json', self.chain)
+            self._write_json('wallets.json', self.wallets)
+            self._write_json('usernames.json', self.usernames)
+            self._write_json('groups.json', self.groups)
+            self._write_json('key_images.json', list(self.spent_key_images))
+            self._write_json('stash_pool.json', self._stash_pool_json())
+            self._write_json('persistent_msgs.json', self.persistent_msgs)
+            self._write_json('reactions.json', self.reactions)
+
+    def save_mining_state(self, poet):
+        """Write PoET win history as binary (tmp file + os.replace, like save_atomic)"""
+        path = self.datadir / MINING_STATE_FILE
+        tmp = path.with_suffix('.bin.tmp')
+        with open(tmp, 'wb') as f:
+            f.write(poet.win_history_bytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def _write_json(self, filename, data):
+        """Fallback writer: encode once (orjson when available), 1 MiB buffered binary write"""
+        with open(self.datadir / filename, 'wb', buffering=1 << 20) as f:
+            f.write(_json_bytes(data))
+
+    def _referrals_json(self):
+        """referrals.json payload — used_by sets flattened back to lists"""
+        codes = {c: dict(r, used_by=list(r.get('used_by', ()))) for c, r in self.referrals.items()}
+        return {'codes': codes, 'map': self.referral_map}
+
+    def _stash_pool_json(self):
+        """stash_pool with the nullifier index flattened back to a list"""
+        return dict(self.stash_pool, spent_nullifiers=list(self.stash_pool.get('spent_nullifiers', [])))
 
     def save_msgs(self):
         """Fast save — only messages + reactions. 10x faster than full save()"""
@@ -686,10 +794,8 @@ class State:
                 self.state_manager.save_atomic('persistent_msgs.json', self.persistent_msgs)
                 self.state_manager.save_atomic('reactions.json', self.reactions)
             else:
-                with open(self.datadir / 'persistent_msgs.json', 'w') as f:
-                    json.dump(self.persistent_msgs, f)
-                with open(self.datadir / 'reactions.json', 'w') as f:
-                    json.dump(self.reactions, f)
+                self._write_json('persistent_msgs.json', self.persistent_msgs)
+                self._write_json('reactions.json', self.reactions)
         except Exception as e:
             print(f"⚠️ save_msgs error: {e}")
 
@@ -699,13 +805,29 @@ class State:
             if STABILITY_ENABLED and self.state_manager:
                 self.state_manager.save_atomic('groups.json', self.groups)
             else:
-                with open(self.datadir / 'groups.json', 'w') as f:
-                    json.dump(self.groups, f)
+                self._write_json('groups.json', self.groups)
         except Exception as e:
             print(f"⚠️ save_groups error: {e}")
 
 S = None
 
+# ─── JSON encoding helpers ───────────────────────────────────────────────────
+def _json_default(obj):
+    """Sets (used_by, nullifier/key-image indexes) serialize as lists"""
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def _json_bytes(obj):
+    """Encode to JSON bytes — orjson when installed, stdlib json otherwise"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj, default=_json_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_json_default).encode()
+
+def _json_response(obj, status=200):
+    """Drop-in for jsonify() on hot endpoints — skips Flask's pure-Python encoder"""
+    return Response(_json_bytes(obj), status=status, mimetype='application/json')
+
 # ─── In-memory cache helpers ─────────────────────────────────────────────────
 import time as _time
 
@@ -786,14 +908,20 @@ def init_mining():
         S.mining_coordinator = LACMiningCoordinator(poet)
         S.mining_active = True
 
-        # Restore win_history from persisted counters (survives restart)
-        saved_history = S.counters.get('win_history', [])
-        if saved_history:
+        # Restore win_history (survives restart) — binary mining state, else legacy counters entry
+        restored = False
+        state_path = S.datadir / MINING_STATE_FILE
+        if state_path.exists():
+            try:
+                restored = poet.load_win_history_bytes(state_path.read_bytes())
+            except Exception as e:
+                print(f"⚠️ {MINING_STATE_FILE} unreadable: {e}")
+        saved_history = S.counters.pop('win_history', None)
+        if not restored and saved_history:
             # Only keep last 100 blocks
-            cutoff = current_height - 100
-            poet.win_history = [(b, a) for b, a in saved_history if b > cutoff]
-            from collections import Counter as _Counter
-            poet.recent_wins = _Counter([a for _, a in poet.win_history])
+            poet.load_win_history(saved_history)
+            restored = True
+        if restored:
             print(f"   Restored {len(poet.win_history)} win history entries")
 
         print(f"⛏️ Mining initialized at block #{current_height}")
@@ -820,15 +948,22 @@ def auto_mining_loop():
 
             # ── Phase 1a: register miners (short lock ~1ms) ─────────
             with S.lock:
-                eligible_miners = []
+                # Columns for one bulk registration (balance minimum applied as a batch mask)
+                addrs, lvls, bals, created = [], [], [], []
+                now_f = time.time()
                 for addr in list(S.active_sessions):
                     w = S.wallets.get(addr)
-                    if not w or w.get('balance', 0) < 50:
+                    if not w:
                         continue
-                    st = S.mining_coordinator.register_miner(
-                        addr, w.get('level', 0), w.get('balance', 0), w.get('created_at', time.time()))
-                    if st.get('mining'):
-                        eligible_miners.append((addr, w.get('level', 0)))
+                    addrs.append(addr)
+                    lvls.append(w.get('level', 0))
+                    bals.append(w.get('balance', 0))
+                    created.append(w.get('created_at', now_f))
+                level_of = dict(zip(addrs, lvls))
+                eligible_miners = [
+                    (addr, level_of[addr])
+                    for addr in S.mining_coordinator.register_miners_bulk(addrs, lvls, bals, created)
+                ]
 
                 if not eligible_miners:
                     continue
@@ -885,10 +1020,11 @@ def auto_mining_loop():
                 }, sort_keys=True).encode()
             ).hexdigest()
 
+            block_txs = mempool_snap + pending_snap
             new_block = {
                 'index': next_index,
                 'timestamp': block_data['timestamp'],
-                'transactions': mempool_snap + pending_snap,
+                'transactions': block_txs,
                 'ephemeral_msgs': eph_snap,
                 'previous_hash': prev_hash,
                 'nonce': 0,
@@ -933,11 +1069,13 @@ def auto_mining_loop():
                             S.username_processor.process_transaction(tx, next_index, S.wallets)
 
                 # Key images
+                block_key_images = []
                 for tx in new_block['transactions']:
                     if tx.get('type') in ['ring_transfer', 'stealth_transfer', 'veil_transfer']:
                         ki = tx.get('ring_signature', {}).get('key_image')
                         if ki:
                             S.spent_key_images.add(ki)
+                            block_key_images.append(ki)
 
                 # Clear mempool
                 S.mempool = S.mempool[50:]
@@ -950,15 +1088,23 @@ def auto_mining_loop():
                 if S.timelock:
                     S.timelock.process_unlocked_transactions(len(S.chain))
 
-                # Pruning
+                # Pruning — in memory only; persisted below, after the lock
+                pruned = False
                 if S.pruning and S.pruning.should_prune(len(S.chain)):
-                    S.pruning.prune_old_blocks()
+                    pruned = S.pruning.prune_old_blocks().get('pruned', False)
+
+            # ── Pruned chain: full rewrite + fsync OUTSIDE lock ──
+            if pruned:
+                try:
+                    S.pruning.persist()
+                except Exception as e:
+                    print(f"⚠️ Pruning save error: {e}")
 
             # ── Zero-history OUTSIDE lock (commitment can take 40s!) ──
             if S.zero_history:
                 try:
                     S.zero_history.add_block(block=new_block, utxo_delta={},
-                                             spent_key_images=list(S.spent_key_images))
+                                             spent_key_images=block_key_images)
                 except Exception as e:
                     print(f"⚠️ zero_history.add_block error: {e}")
 
@@ -971,7 +1117,7 @@ def auto_mining_loop():
             # ── Phase 4: save + invalidate cache (no lock needed) ──
             try:
                 if S.mining_coordinator and S.mining_coordinator.poet:
-                    S.counters['win_history'] = list(S.mining_coordinator.poet.win_history[-200:])
+                    S.save_mining_state(S.mining_coordinator.poet)
                 S.save()
             except Exception as e:
                 print(f"⚠️ Save error: {e}")
@@ -988,7 +1134,7 @@ def auto_mining_loop():
 
         except Exception as e:
             print(f"❌ Mining error: {e}")
-            import traceback; traceback.print_exc()
+            traceback.print_exc()
             time.sleep(5)
 
 
@@ -1057,8 +1203,9 @@ except ImportError:
 
 # ===== PROOF-OF-LOCATION MODULE =====
 POL_AVAILABLE = False
+ALL_ZONES = {}
 try:
-    from lac_proof_of_location import ProofOfLocation
+    from lac_proof_of_location import ProofOfLocation, ALL_ZONES
     POL_AVAILABLE = True
     pol_zones = ProofOfLocation.get_available_zones()
     print(f"✅ Proof-of-Location loaded — {pol_zones['total_zones']} zones")
@@ -1122,11 +1269,56 @@ def get_address_from_seed(seed):
                 if tx.get('to') == legacy: tx['to'] = new_addr
                 if tx.get('real_from') == legacy: tx['real_from'] = new_addr
                 if tx.get('real_to') == legacy: tx['real_to'] = new_addr
+        if S.chain_store:
+            S.chain_store.invalidate()  # history edited in place — next save rewrites chain.ndjson
         try: S.save()
         except: pass
     
     return new_addr
 
+def set_level(wallet, level):
+    """Set wallet level, keeping S.agg['level_counts'] in step"""
+    counts = S.agg['level_counts']
+    old = wallet.get('level', 0)
+    if old:
+        counts[old] -= 1
+    if level:
+        counts[level] += 1
+    wallet['level'] = level
+
+def _dms_enabled(wallet):
+    return bool((wallet.get('dead_mans_switch') or {}).get('enabled'))
+
+def _username_cost(name):
+    """Burn cost implied by a wallet's username (0 for none/placeholder)"""
+    if not name or name in ('Anonymous', 'None'):
+        return 0
+    return _UNAME_COST_TBL[len(name)] if len(name) < 64 else 10
+
+def set_username(wallet, name):
+    """Set wallet username, keeping S.agg['username_burn'] in step"""
+    S.agg['username_burn'] += _username_cost(name) - _username_cost(wallet.get('username', ''))
+    wallet['username'] = name
+
+def set_dms(wallet, dms):
+    """Set (None: remove) wallet's dead man's switch, keeping S.agg['dms_active'] in step"""
+    was_enabled = _dms_enabled(wallet)
+    if dms is None:
+        wallet.pop('dead_mans_switch', None)
+    else:
+        wallet['dead_mans_switch'] = dms
+    S.agg['dms_active'] += _dms_enabled(wallet) - was_enabled
+
+def _agg_wallet_removed(wallet):
+    """Drop a deleted wallet from S.agg (level-0 wallets are implied in level_counts)"""
+    agg = S.agg
+    lv = wallet.get('level', 0)
+    if lv:
+        agg['level_counts'][lv] -= 1
+    agg['dice_games'] -= len(wallet.get('dice_history', ()))
+    agg['dms_active'] -= _dms_enabled(wallet)
+    agg['username_burn'] -= _username_cost(wallet.get('username', ''))
+
 def get_key_id_from_seed(seed):
     """Derive key_id from seed (PRIVATE)"""
     return hashlib.sha256(f"keyid_{seed}".encode()).hexdigest()
@@ -1380,6 +1572,7 @@ def auto_cleanup():
                                 if key_id and key_id in S.usernames:
                                     S.usernames.pop(key_id)
                                 S.wallets.pop(addr, None)
+                                _agg_wallet_removed(wallet)
                                 S.active_sessions.discard(addr)
                                 print(f"  💀 Wallet wiped completely")
                                 break  # wallet gone, stop processing
@@ -1387,8 +1580,8 @@ def auto_cleanup():
                             print(f"  ⚠️ DMS action error: {ae}")
                     # Mark DMS as triggered (if wallet still exists)
                     if addr in S.wallets:
-                        S.wallets[addr]['dead_mans_switch']['enabled'] = False
-                        S.wallets[addr]['dead_mans_switch']['triggered_at'] = now
+                        w_dms = S.wallets[addr]
+                        set_dms(w_dms, dict(w_dms['dead_mans_switch'], enabled=False, triggered_at=now))
                     S.save()
                 # ===== END DEAD MAN'S SWITCH =====
         except Exception as e:
@@ -1559,6 +1752,16 @@ def _ref_anon_id(addr):
     """Anonymous ID for on-chain records — sha256 hash of address"""
     return hashlib.sha256(addr.encode()).hexdigest()[:16]
 
+_REFERRAL_TX_TEMPLATE = {'from': 'referral_system'}
+
+def _referral_tx(tx_type, addr, amount, timestamp, **extra):
+    """On-chain referral payout record: shared template + the per-payout fields"""
+    tx = {'type': tx_type, **_REFERRAL_TX_TEMPLATE,
+          'to': _ref_anon_id(addr), 'amount': amount, 'timestamp': timestamp}
+    if extra:
+        tx.update(extra)
+    return tx
+
 def get_referral_phase():
     """Phase based on total wallet count"""
     total = len(S.wallets)
@@ -1641,7 +1844,7 @@ def register():
             if ref_code:
                 referral_data = S.referrals[ref_code]
                 # Self-referral check via anonymous hash
-                if referral_data.get('creator_hash') != _ref_anon_id(addr) and addr not in referral_data.get('used_by', []):
+                if referral_data.get('creator_hash') != _ref_anon_id(addr) and addr not in referral_data.get('used_by', ()):
                     # Phase-based bonus
                     phase = get_referral_phase()
                     if phase in (1, 2, 3):
@@ -1650,14 +1853,12 @@ def register():
                     # Phase 2: referrer also gets 30
                     if phase == 2:
                         # Find referrer by code (server-side only, not exposed)
-                        for a, rm in S.referral_map.items():
-                            if rm.get('invite_code') == ref_code and a in S.wallets:
-                                S.wallets[a]['balance'] += 30
-                                S.mempool.append({'type': 'referral_bonus', 'from': 'referral_system',
-                                    'to': _ref_anon_id(a), 'amount': 30, 'timestamp': int(time.time()), 'phase': 2})
-                                break
+                        a = S.referral_owner.get(ref_code)
+                        if a in S.wallets:
+                            S.wallets[a]['balance'] += 30
+                            S.mempool.append(_referral_tx('referral_bonus', a, 30, int(time.time()), phase=2))
                     # Track anonymously
-                    referral_data.setdefault('used_by', []).append(addr)
+                    referral_data.setdefault('used_by', set()).add(addr)
                     referral_data.setdefault('quests_claimed', [])
                     if addr not in S.referral_map:
                         S.referral_map[addr] = {}
@@ -1666,13 +1867,11 @@ def register():
                     # On-chain anonymous record
                     if ref_bonus > 0:
                         S.counters['emitted_referral'] = S.counters.get('emitted_referral', 0) + ref_bonus
-                        S.mempool.append({'type': 'referral_join_bonus', 'from': 'referral_system',
-                            'to': _ref_anon_id(addr), 'amount': ref_bonus,
-                            'timestamp': int(time.time()), 'phase': phase})
+                        S.mempool.append(_referral_tx('referral_join_bonus', addr, ref_bonus,
+                                                      int(time.time()), phase=phase))
         except Exception as _ref_err:
-            import traceback as _tb
             print(f"❌ REFERRAL ERROR in register: {_ref_err}")
-            _tb.print_exc()
+            traceback.print_exc()
             ref_bonus = 0  # skip referral, don't block registration
         
     S.counters['emitted_faucet'] = S.counters.get('emitted_faucet', 0) + 30  # welcome bonus
@@ -2807,11 +3006,12 @@ def dice_play():
         wallet['last_dice'] = int(time.time())
 
         # Store in wallet history
-        if 'dice_history' not in wallet:
-            wallet['dice_history'] = []
-        wallet['dice_history'].append(game_record)
-        # Keep last 50
-        wallet['dice_history'] = wallet['dice_history'][-500:]
+        history = wallet.get('dice_history', [])
+        before = len(history)
+        history.append(game_record)
+        # Keep last 500
+        history = wallet['dice_history'] = history[-500:]
+        S.agg['dice_games'] += len(history) - before
         
         S.save()
         
@@ -3978,6 +4178,7 @@ def panic():
         if addr in S.wallets:
             # Remove wallet
             wallet = S.wallets.pop(addr)
+            _agg_wallet_removed(wallet)
             
             # Remove username mapping
             key_id = wallet.get('key_id')
@@ -4029,13 +4230,13 @@ def dms_setup():
         if addr not in S.wallets:
             return jsonify({'error': 'Wallet not found'}), 404
         
-        S.wallets[addr]['dead_mans_switch'] = {
+        set_dms(S.wallets[addr], {
             'enabled': True,
             'timeout_days': timeout_days,
             'actions': actions,
             'created_at': int(time.time()),
             'triggered_at': None
-        }
+        })
         S.wallets[addr]['last_activity'] = int(time.time())
         S.save()
         
@@ -4095,7 +4296,7 @@ def dms_cancel():
         if addr not in S.wallets:
             return jsonify({'error': 'Wallet not found'}), 404
         
-        S.wallets[addr].pop('dead_mans_switch', None)
+        set_dms(S.wallets[addr], None)
         S.save()
         
         return jsonify({'ok': True, 'message': 'Dead Man Switch disabled'})
@@ -4158,7 +4359,7 @@ def change_nickname():
         # Add new username
         clean_name = new_nickname.lstrip('@').lower()
         S.usernames[clean_name] = addr
-        wallet['username'] = clean_name
+        set_username(wallet, clean_name)
         
         S.save()
         burn_tx["old_nickname"] = old_nickname
@@ -4228,7 +4429,7 @@ def upgrade_level():
         
         # Burn the cost
         wallet['balance'] -= cost
-        wallet['level'] = current_level + 1
+        set_level(wallet, current_level + 1)
         S.counters['burned_levels'] += cost
 
         # Check referral quests after level-up (non-blocking)
@@ -4495,7 +4696,6 @@ def zero_history_stats():
             'l2_lifetime_days': 90
         })
     except Exception as e:
-        import traceback
         traceback.print_exc()
         return jsonify({'error': f'Stats error: {str(e)}'}), 500
 
@@ -5328,7 +5528,7 @@ def username_register():
         S.usernames[username] = addr
         wallet['balance'] -= price
         S.counters['burned_username'] += price
-        wallet['username'] = username
+        set_username(wallet, username)
         wallet['tx_count'] = wallet.get('tx_count', 0) + 1
         
         # Blockchain TX (receipt — will be erased by ZH, but mapping persists in State)
@@ -6144,7 +6344,6 @@ def main():
                 print("[WebSocket] Real-time sync initialized")
         except Exception as e:
             print(f"[WebSocket] Initialization failed: {e}")
-            import traceback
             traceback.print_exc()
             ws_sync = None
     
@@ -6201,6 +6400,7 @@ def main():
     
     # Auto-cleanup still active
     Thread(target=auto_cleanup, daemon=True).start()
+    _start_bg_save()
     
     print(f"""
 🔥🔥🔥 [LAC Ephemeral Chain v2.0 SECURED + P2P SYNC + PoET] 🔥🔥🔥
@@ -6317,8 +6517,74 @@ def get_decoy_stats():
 # ============================================================================
 
 STASH_NOMINALS = {0: 100, 1: 1_000, 2: 10_000, 3: 100_000}
+STASH_NOMINAL_BY_AMOUNT = {v: k for k, v in STASH_NOMINALS.items()}
+_STASH_KEY_RE = _re.compile(r'STASH-(\d+)-([0-9a-fA-F]{64})')
 STASH_FEE = 2.0
 
+def _derive_phantom_ephemeral(r0, n):
+    """Phantom ephemeral #n from one batch root R0 — R_n = H(R0, n), keyed BLAKE2b"""
+    return hashlib.blake2b(n.to_bytes(4, 'big'), key=r0, person=b'phantom_eph_v1',
+                           digest_size=32).digest()
+
+def _build_phantom_txs(r0, count, decoy_pool, fee):
+    """
+    Build `count` phantom VEIL TXs — pure function, no shared state touched.
+    Kept free of S / Flask so it can run outside S.lock and be compiled
+    ahead-of-time later without touching the handler.
+    """
+    sha256 = hashlib.sha256
+    token_bytes = secrets.token_bytes
+    token_hex = secrets.token_hex
+    randbelow = secrets.randbelow
+    randint = _random.randint
+    sample = _random.sample
+    now = int(time.time())
+    pool_size = len(decoy_pool)
+    phantoms = []
+    for p in range(count):
+        # Each phantom gets unique crypto — indistinguishable from real
+        p_ephemeral = _derive_phantom_ephemeral(r0, p)
+        p_shared = sha256(p_ephemeral + token_bytes(32)).digest()
+        p_ota = f"veil_{sha256(b'OTA' + p_shared).hexdigest()[:64]}"
+        
+        p_key_image = sha256(b"VEIL_KI" + token_bytes(48)).hexdigest()
+        
+        # Unique ring for each phantom (different decoys)
+        p_decoy_count = min(randint(6, 14), pool_size)
+        p_ring = []
+        if p_decoy_count > 0:
+            p_ring = [sha256(d.encode()).hexdigest()[:32] for d in sample(decoy_pool, p_decoy_count)]
+        # Insert a fake "sender" key at random position
+        p_ring.insert(randbelow(len(p_ring) + 1), token_hex(16))
+        
+        p_tx_id = sha256(f"veil_phantom_{now}_{token_hex(16)}".encode()).hexdigest()
+        p_payload = sha256(
+            json.dumps({'p': token_hex(8), 'ts': now}).encode()
+        ).hexdigest()
+        
+        phantoms.append({
+            'type': 'veil_transfer',
+            'tx_id': p_tx_id,
+            'from': 'anonymous',
+            'to': p_ota,
+            'amount': 0,
+            'fee': fee,
+            'ephemeral': p_ephemeral.hex(),
+            'payload_hash': p_payload,
+            'ring_signature': {
+                'key_image': p_key_image,
+                'ring': p_ring,
+                'ring_size': len(p_ring),
+                'c0': token_hex(16),
+                'responses': [token_hex(8) for _ in p_ring]
+            },
+            'timestamp': now,
+            'anonymous': True
+            # NO real_from, real_to, real_amount → mining loop ignores
+            # NO balance changes → pure noise for observers
+        })
+    return phantoms
+
 @app.route('/api/transfer/veil', methods=['POST'])
 def veil_transfer():
     """
@@ -6347,17 +6613,22 @@ def veil_transfer():
         
         if not to_input or amount <= 0:
             return jsonify({'error': 'Invalid recipient or amount', 'ok': False}), 400
+        now = int(time.time())
+        
+        # Resolve recipient before taking the lock — read-only lookup,
+        # re-checked below in case the wallet set changed meanwhile
+        try:
+            to_addr = resolve_recipient(to_input) or (to_input if to_input in S.wallets else None)
+        except RuntimeError:  # wallets resized during the username scan
+            to_addr = None
         
         with S.lock:
             if from_addr not in S.wallets:
                 return jsonify({'error': 'Wallet not found', 'ok': False}), 404
             
-            # Resolve recipient
-            to_addr = resolve_recipient(to_input)
-            if not to_addr:
-                if to_input in S.wallets:
-                    to_addr = to_input
-                else:
+            if to_addr not in S.wallets:
+                to_addr = resolve_recipient(to_input) or (to_input if to_input in S.wallets else None)
+                if not to_addr:
                     return jsonify({'error': 'Recipient not found', 'ok': False}), 404
             
             veil_fee = 1.0
@@ -6421,12 +6692,12 @@ def veil_transfer():
             
             # 4. Encrypted payload hash
             payload_hash = hashlib.sha256(
-                json.dumps({'to': to_addr, 'amount': amount, 'ts': int(time.time())}).encode()
+                json.dumps({'to': to_addr, 'amount': amount, 'ts': now}).encode()
             ).hexdigest()
             
             # 5. TX ID
             tx_id = hashlib.sha256(
-                f"veil_{from_addr}_{amount}_{int(time.time())}_{secrets.token_hex(8)}".encode()
+                f"veil_{from_addr}_{amount}_{now}_{secrets.token_hex(8)}".encode()
             ).hexdigest()
             
             # 6. Build transaction (visible on-chain: anonymous from/to, hidden amount)
@@ -6443,7 +6714,7 @@ def veil_transfer():
                 'ephemeral': ephemeral.hex() if isinstance(ephemeral, bytes) else ephemeral,
                 'payload_hash': payload_hash,
                 'ring_signature': None,  # Will be set below
-                'timestamp': int(time.time()),
+                'timestamp': now,
                 'anonymous': True
             }
             
@@ -6486,60 +6757,14 @@ def veil_transfer():
             all_addrs_for_phantoms = [a for a in S.wallets.keys() 
                                        if not a.startswith('seed_000')]
             
-            for p in range(phantom_count):
-                # Each phantom gets unique crypto — indistinguishable from real
-                p_ephemeral = secrets.token_bytes(32)
-                p_shared = hashlib.sha256(p_ephemeral + secrets.token_bytes(32)).digest()
-                p_ota = f"veil_{hashlib.sha256(b'OTA' + p_shared).hexdigest()[:64]}"
-                
-                p_key_image = hashlib.sha256(
-                    b"VEIL_KI" + secrets.token_bytes(32) + secrets.token_bytes(16)
-                ).hexdigest()
-                
-                # Unique ring for each phantom (different decoys)
-                p_ring_target = random.randint(6, 14)
-                p_decoy_count = min(p_ring_target, len(all_addrs_for_phantoms))
-                p_ring = []
-                if p_decoy_count > 0:
-                    p_decoys = random.sample(all_addrs_for_phantoms, p_decoy_count)
-                    p_ring = [hashlib.sha256(d.encode()).hexdigest()[:32] for d in p_decoys]
-                # Insert a fake "sender" key at random position
-                p_fake_sender = secrets.token_hex(16)
-                p_ring.insert(secrets.randbelow(len(p_ring) + 1), p_fake_sender)
-                
-                p_tx_id = hashlib.sha256(
-                    f"veil_phantom_{int(time.time())}_{secrets.token_hex(16)}".encode()
-                ).hexdigest()
-                
-                p_payload = hashlib.sha256(
-                    json.dumps({'p': secrets.token_hex(8), 'ts': int(time.time())}).encode()
-                ).hexdigest()
-                
-                phantom_tx = {
-                    'type': 'veil_transfer',
-                    'tx_id': p_tx_id,
-                    'from': 'anonymous',
-                    'to': p_ota,
-                    'amount': 0,
-                    'fee': veil_fee,
-                    'ephemeral': p_ephemeral.hex(),
-                    'payload_hash': p_payload,
-                    'ring_signature': {
-                        'key_image': p_key_image,
-                        'ring': p_ring,
-                        'ring_size': len(p_ring),
-                        'c0': secrets.token_hex(16),
-                        'responses': [secrets.token_hex(8) for _ in p_ring]
-                    },
-                    'timestamp': int(time.time()),
-                    'anonymous': True
-                    # NO real_from, real_to, real_amount → mining loop ignores
-                    # NO balance changes → pure noise for observers
-                }
-                all_txs.append(phantom_tx)
-                
-                # Track phantom key_images too (prevents reuse, looks real)
-                S.spent_key_images.add(p_key_image)
+            # One RNG draw per batch — every phantom ephemeral is derived from R0
+            phantom_r0 = secrets.token_bytes(32)
+            
+            phantom_txs = _build_phantom_txs(phantom_r0, phantom_count, all_addrs_for_phantoms, veil_fee)
+            all_txs.extend(phantom_txs)
+            # Track phantom key_images too (prevents reuse, looks real)
+            for phantom_tx in phantom_txs:
+                S.spent_key_images.add(phantom_tx['ring_signature']['key_image'])
             
             # Shuffle so real TX is at random position
             random.shuffle(all_txs)
@@ -6555,7 +6780,7 @@ def veil_transfer():
             if to_addr not in S.wallets:
                 S.wallets[to_addr] = {
                     'balance': 0, 'level': 0,
-                    'created_at': int(time.time()),
+                    'created_at': now,
                     'tx_count': 0, 'msg_count': 0
                 }
             S.wallets[to_addr]['balance'] += amount
@@ -6581,8 +6806,8 @@ def veil_transfer():
             })
     except Exception as e:
         print(f"VEIL error: {e}")
-        import traceback
-        traceback.print_exc()
+        if app.debug:
+            traceback.print_exc()
         return jsonify({'error': f'VEIL failed: {str(e)}', 'ok': False}), 500
 
 
@@ -6615,13 +6840,34 @@ def stash_deposit():
             return jsonify({'error': 'Invalid nominal. Use: 0=100, 1=1K, 2=10K, 3=100K', 'ok': False}), 400
         
         amount = STASH_NOMINALS[nominal_code]
+        now = int(time.time())
+        total_needed = amount + STASH_FEE
+        
+        # Generate STASH key + TX outside the lock — no shared state involved
+        secret = secrets.token_bytes(32)
+        secret_hex = secret.hex()
+        # Single hash — already commits to the 256-bit secret
+        nullifier_hash = hashlib.sha256(b"STASH_NULL" + secret).digest().hex()
+        stash_key = f'STASH-{amount}-{secret_hex}'
+        
+        # Blockchain TX — sender hidden
+        tx = {
+            'type': 'stash_deposit',
+            'from': 'anonymous',
+            'to': 'stash_pool',
+            'amount': amount,
+            'fee': STASH_FEE,
+            'nominal_code': nominal_code,
+            'nullifier_hash': nullifier_hash,
+            'real_from': from_addr,
+            'timestamp': now
+        }
         
         with S.lock:
             if from_addr not in S.wallets:
                 return jsonify({'error': 'Wallet not found', 'ok': False}), 404
             
             from_wallet = S.wallets[from_addr]
-            total_needed = amount + STASH_FEE
             
             if from_wallet.get('balance', 0) < total_needed:
                 return jsonify({
@@ -6629,24 +6875,6 @@ def stash_deposit():
                     'ok': False
                 }), 400
             
-            # Generate STASH key
-            secret = secrets.token_bytes(32)
-            nullifier = hashlib.sha256(b"STASH_NULL" + secret).hexdigest()
-            nullifier_hash = hashlib.sha256(nullifier.encode()).hexdigest()
-            stash_key = f'STASH-{amount}-{secret.hex()}'
-            
-            # Blockchain TX — sender hidden
-            tx = {
-                'type': 'stash_deposit',
-                'from': 'anonymous',
-                'to': 'stash_pool',
-                'amount': amount,
-                'fee': STASH_FEE,
-                'nominal_code': nominal_code,
-                'nullifier_hash': nullifier_hash,
-                'real_from': from_addr,
-                'timestamp': int(time.time())
-            }
             S.mempool.append(tx)
             
             # Deduct balance
@@ -6659,23 +6887,23 @@ def stash_deposit():
             S.stash_pool['deposits'][nullifier_hash] = {
                 'amount': amount,
                 'nominal': nominal_code,
-                'timestamp': int(time.time())
+                'timestamp': now
             }
-            
-            S.save()
-            
-            return jsonify({
-                'ok': True,
-                'stash_key': stash_key,
-                'amount': amount,
-                'fee': STASH_FEE,
-                'nominal': nominal_code,
-                'message': '⚠️ SAVE THIS KEY! It cannot be recovered.'
-            })
+        
+        S.save()
+        
+        return jsonify({
+            'ok': True,
+            'stash_key': stash_key,
+            'amount': amount,
+            'fee': STASH_FEE,
+            'nominal': nominal_code,
+            'message': '⚠️ SAVE THIS KEY! It cannot be recovered.'
+        })
     except Exception as e:
         print(f"STASH deposit error: {e}")
-        import traceback
-        traceback.print_exc()
+        if app.debug:
+            traceback.print_exc()
         return jsonify({'error': f'STASH deposit failed: {str(e)}', 'ok': False}), 500
 
 
@@ -6705,24 +6933,14 @@ def stash_withdraw():
         amount = None
         nominal_code = None
         
-        # New format: STASH-{amount}-{hex}
+        # New format: STASH-{amount}-{hex} — validated and split in one regex match
         if stash_key.startswith('STASH-'):
-            parts = stash_key.split('-', 2)
-            if len(parts) == 3:
-                try:
-                    amount = int(parts[1])
-                    secret_hex = parts[2]
-                    # Reverse lookup nominal_code from amount
-                    for nc, val in STASH_NOMINALS.items():
-                        if val == amount:
-                            nominal_code = nc
-                            break
-                    if nominal_code is None:
-                        nominal_code = 0  # fallback
-                except:
-                    return jsonify({'error': 'Invalid STASH key format', 'ok': False}), 400
-            else:
+            m = _STASH_KEY_RE.fullmatch(stash_key)
+            if not m:
                 return jsonify({'error': 'Invalid STASH key format', 'ok': False}), 400
+            amount = int(m.group(1))
+            secret_hex = m.group(2)
+            nominal_code = STASH_NOMINAL_BY_AMOUNT.get(amount, 0)
         # Old format: stash_{"v":1,"n":0,"s":"hex"}
         elif stash_key.startswith('stash_{'):
             try:
@@ -6745,66 +6963,72 @@ def stash_withdraw():
         except Exception:
             return jsonify({'error': 'Invalid secret', 'ok': False}), 400
         
-        nullifier = hashlib.sha256(b"STASH_NULL" + secret).hexdigest()
-        nullifier_hash = hashlib.sha256(nullifier.encode()).hexdigest()
+        nullifier = hashlib.sha256(b"STASH_NULL" + secret).digest().hex()
+        
+        # Blockchain TX — recipient hidden; amount filled from the pool record below
+        tx = {
+            'type': 'stash_withdraw',
+            'from': 'stash_pool',
+            'to': f"stash_{secrets.token_hex(16)}",
+            'amount': 0,
+            'fee': 0,
+            'nominal_code': nominal_code,
+            'nullifier': nullifier,
+            'real_to': to_addr,
+            'timestamp': int(time.time())
+        }
         
         with S.lock:
             if to_addr not in S.wallets:
                 return jsonify({'error': 'Wallet not found', 'ok': False}), 404
             
-            spent = set(S.stash_pool.get('spent_nullifiers', []))
-            if nullifier in spent:
+            pool = S.stash_pool
+            if nullifier in pool['spent_nullifiers']:
                 return jsonify({'error': 'STASH key already spent', 'ok': False}), 400
             
             # SECURITY: key must exist in pool — no deposit record = fake key
-            deposit_record = S.stash_pool.get('deposits', {}).get(nullifier_hash)
+            # Deposits are keyed by the nullifier itself; pre-upgrade ones by sha256(nullifier)
+            deposits = pool.get('deposits', {})
+            nullifier_hash = nullifier
+            deposit_record = deposits.get(nullifier_hash)
+            if not deposit_record:
+                nullifier_hash = hashlib.sha256(nullifier.encode()).hexdigest()
+                deposit_record = deposits.get(nullifier_hash)
             if not deposit_record:
                 return jsonify({'error': 'STASH key not found in pool', 'ok': False}), 400
             amount = deposit_record['amount']  # always use server-side amount
             
-            pool_balance = S.stash_pool.get('total_balance', 0)
+            pool_balance = pool.get('total_balance', 0)
             if pool_balance < amount:
                 return jsonify({'error': 'Insufficient pool balance', 'ok': False}), 400
             
-            # Blockchain TX — recipient hidden
-            withdraw_ota = f"stash_{hashlib.sha256(secrets.token_bytes(32)).hexdigest()[:32]}"
-            tx = {
-                'type': 'stash_withdraw',
-                'from': 'stash_pool',
-                'to': withdraw_ota,
-                'amount': amount,
-                'fee': 0,
-                'nominal_code': nominal_code,
-                'nullifier': nullifier,
-                'real_to': to_addr,
-                'timestamp': int(time.time())
-            }
+            tx['amount'] = amount
             S.mempool.append(tx)
             
             # Credit recipient
-            S.wallets[to_addr]['balance'] += amount
-            S.wallets[to_addr]['tx_count'] = S.wallets[to_addr].get('tx_count', 0) + 1
+            w = S.wallets[to_addr]
+            w['balance'] += amount
+            w['tx_count'] = w.get('tx_count', 0) + 1
             
             # Update pool
-            S.stash_pool['total_balance'] -= amount
-            if 'spent_nullifiers' not in S.stash_pool:
-                S.stash_pool['spent_nullifiers'] = []
-            S.stash_pool['spent_nullifiers'].append(nullifier)
+            pool['total_balance'] -= amount
+            pool['spent_nullifiers'].add(nullifier)
             # Remove deposit record after withdrawal
-            S.stash_pool.get('deposits', {}).pop(nullifier_hash, None)
-            
-            S.save()
-            
-            return jsonify({
-                'ok': True,
-                'amount': amount,
-                'balance': S.wallets[to_addr].get('balance', 0),
-                'message': '✅ STASH key redeemed!'
-            })
+            deposits.pop(nullifier_hash, None)
+            balance = w.get('balance', 0)
+        
+        S.save()
+        
+        return jsonify({
+            'ok': True,
+            'amount': amount,
+            'balance': balance,
+            'message': '✅ STASH key redeemed!'
+        })
     except Exception as e:
         print(f"STASH withdraw error: {e}")
-        import traceback
-        traceback.print_exc()
+        if app.debug:
+            traceback.print_exc()
         return jsonify({'error': f'STASH withdraw failed: {str(e)}', 'ok': False}), 500
 
 
@@ -6848,7 +7072,7 @@ REFERRAL_QUESTS = [
 def _get_ref_counts(code):
     """Count referrals by level for a given invite code"""
     referral = S.referrals.get(code, {})
-    used_by = referral.get('used_by', [])
+    used_by = referral.get('used_by', ())
     l1 = l2 = l3 = 0
     for addr in used_by:
         lvl = S.wallets.get(addr, {}).get('level', 0)
@@ -6875,11 +7099,7 @@ def check_and_claim_quests(leveled_up_addr):
     referral = S.referrals[invited_by_code]
 
     # Find referrer address (owner of invited_by_code)
-    referrer_addr = None
-    for a, rm in S.referral_map.items():
-        if rm.get('invite_code') == invited_by_code:
-            referrer_addr = a
-            break
+    referrer_addr = S.referral_owner.get(invited_by_code)
 
     if not referrer_addr or referrer_addr not in S.wallets:
         return []
@@ -6901,15 +7121,8 @@ def check_and_claim_quests(leveled_up_addr):
             referrer_wallet['balance'] = referrer_wallet.get('balance', 0) + q['reward']
             claimed.add(qid)
             newly_claimed.append(q)
-            S.mempool.append({
-                'type': 'referral_quest',
-                'from': 'referral_system',
-                'to': _ref_anon_id(referrer_addr),
-                'amount': q['reward'],
-                'quest_id': qid,
-                'quest_label': q['label'],
-                'timestamp': int(time.time()),
-            })
+            S.mempool.append(_referral_tx('referral_quest', referrer_addr, q['reward'], int(time.time()),
+                                          quest_id=qid, quest_label=q['label']))
             print(f"🎯 Quest {qid} auto-claimed for {referrer_addr[:8]}… +{q['reward']} LAC (ref leveled up)")
 
     if newly_claimed:
@@ -6921,7 +7134,7 @@ def check_and_claim_quests(leveled_up_addr):
             ref_file = _Path('data/referrals.json')
             ref_file.parent.mkdir(exist_ok=True)
             with open(ref_file, 'w') as _f:
-                _json.dump({'codes': S.referrals, 'map': S.referral_map}, _f)
+                _json.dump(S._referrals_json(), _f)
         except Exception as _e:
             print(f"⚠️ referrals save error: {_e}")
         S.save()
@@ -6933,34 +7146,38 @@ def referral_get_code():
     """Get or create your referral invite code"""
     seed = request.headers.get('X-Seed', '').strip()
     if not validate_seed(seed):
-        return jsonify({'error': 'Unauthorized'}), 401
+        return _json_response({'error': 'Unauthorized'}), 401
 
     addr = get_address_from_seed(seed)
 
     with S.lock:
         if addr not in S.wallets:
-            return jsonify({'error': 'Wallet not found'}), 404
+            return _json_response({'error': 'Wallet not found'}), 404
 
         ref = S.referral_map.get(addr, {})
         code = ref.get('invite_code')
 
         if not code:
-            # Generate unique code
-            code = 'REF-' + secrets.token_hex(4).upper()
-            while code in S.referrals:
-                code = 'REF-' + secrets.token_hex(4).upper()
+            # Generate unique code — one RNG call yields 8 candidates
+            code = None
+            while code is None:
+                pool = secrets.token_bytes(32)
+                for i in range(0, 32, 4):
+                    candidate = 'REF-' + pool[i:i + 4].hex().upper()
+                    if candidate not in S.referrals:
+                        code = candidate
+                        break
             S.referrals[code] = {
                 'creator_hash': _ref_anon_id(addr),  # anonymous
-                'used_by': [],
+                'used_by': set(),
                 'created_at': int(time.time()),
                 'quests_claimed': [],
             }
-            if addr not in S.referral_map:
-                S.referral_map[addr] = {}
-            S.referral_map[addr]['invite_code'] = code
+            S.referral_map.setdefault(addr, {})['invite_code'] = code
+            S.referral_owner[code] = addr
             S.save()
 
-        used_count = len(S.referrals.get(code, {}).get('used_by', []))
+        used_count = len(S.referrals.get(code, {}).get('used_by', ()))
         l1, l2, l3 = _get_ref_counts(code)
         claimed = S.referrals.get(code, {}).get('quests_claimed', [])
         phase = get_referral_phase()
@@ -6986,7 +7203,7 @@ def referral_get_code():
                 'done': done,
             })
 
-        return jsonify({
+        return _json_response({
             'ok': True,
             'code': code,
             'vanity': vanity,
@@ -7005,22 +7222,23 @@ def referral_use():
     """Use an invite code — anonymous, no link between referrer identity and referral"""
     seed = request.headers.get('X-Seed', '').strip()
     if not validate_seed(seed):
-        return jsonify({'error': 'Unauthorized'}), 401
+        return _json_response({'error': 'Unauthorized'}), 401
 
     addr = get_address_from_seed(seed)
     data = request.get_json() or {}
     raw_code = data.get('code', '').strip().upper()
 
     if not raw_code:
-        return jsonify({'error': 'Code required'}), 400
+        return _json_response({'error': 'Code required'}), 400
 
+    now = int(time.time())
     with S.lock:
         if addr not in S.wallets:
-            return jsonify({'error': 'Wallet not found'}), 404
+            return _json_response({'error': 'Wallet not found'}), 404
 
         ref = S.referral_map.get(addr, {})
         if ref.get('invited_by_code'):
-            return jsonify({'error': 'Already used a referral code', 'ok': False}), 400
+            return _json_response({'error': 'Already used a referral code', 'ok': False}), 400
 
         # Support both REF-XXXX and vanity codes
         code = raw_code
@@ -7032,24 +7250,23 @@ def referral_use():
                     found_code = c
                     break
             if not found_code:
-                return jsonify({'error': 'Invalid referral code', 'ok': False}), 400
+                return _json_response({'error': 'Invalid referral code', 'ok': False}), 400
             code = found_code
 
         referral = S.referrals[code]
 
         # Self-referral check via hash
         if referral.get('creator_hash') == _ref_anon_id(addr):
-            return jsonify({'error': 'Cannot use your own code', 'ok': False}), 400
+            return _json_response({'error': 'Cannot use your own code', 'ok': False}), 400
 
-        if addr in referral.get('used_by', []):
-            return jsonify({'error': 'Already used this code', 'ok': False}), 400
+        if addr in referral.get('used_by', ()):
+            return _json_response({'error': 'Already used this code', 'ok': False}), 400
 
         # Link — store code, NOT referrer address (anonymous)
-        referral.setdefault('used_by', []).append(addr)
-        if addr not in S.referral_map:
-            S.referral_map[addr] = {}
-        S.referral_map[addr]['invited_by_code'] = code
-        S.referral_map[addr]['joined_at'] = int(time.time())
+        referral.setdefault('used_by', set()).add(addr)
+        ref = S.referral_map.setdefault(addr, {})
+        ref['invited_by_code'] = code
+        ref['joined_at'] = now
 
         # Registration bonus based on phase
         phase = get_referral_phase()
@@ -7063,31 +7280,24 @@ def referral_use():
             bonus_referral = 30
             # Find referrer and give them 30 too
             # We know the code but keep it anonymous on-chain
-            for a, rm in S.referral_map.items():
-                if rm.get('invite_code') == code:
-                    S.wallets[a]['balance'] = S.wallets[a].get('balance', 0) + 30
-                    bonus_referrer = 30
-                    S.mempool.append({
-                        'type': 'referral_bonus', 'from': 'referral_system',
-                        'to': _ref_anon_id(a), 'amount': 30,
-                        'timestamp': int(time.time()), 'phase': 2
-                    })
-                    break
+            a = S.referral_owner.get(code)
+            if a is not None:
+                referrer_wallet = S.wallets[a]
+                referrer_wallet['balance'] = referrer_wallet.get('balance', 0) + 30
+                bonus_referrer = 30
+                S.mempool.append(_referral_tx('referral_bonus', a, 30, now, phase=2))
         elif phase == 3:
             bonus_referral = 30  # only new user
 
         if bonus_referral > 0:
-            S.wallets[addr]['balance'] = S.wallets[addr].get('balance', 0) + bonus_referral
+            wallet = S.wallets[addr]
+            wallet['balance'] = wallet.get('balance', 0) + bonus_referral
             # On-chain: anonymous
-            S.mempool.append({
-                'type': 'referral_join_bonus', 'from': 'referral_system',
-                'to': _ref_anon_id(addr), 'amount': bonus_referral,
-                'timestamp': int(time.time()), 'phase': phase
-            })
+            S.mempool.append(_referral_tx('referral_join_bonus', addr, bonus_referral, now, phase=phase))
 
         S.save()
 
-        return jsonify({
+        return _json_response({
             'ok': True,
             'bonus': bonus_referral,
             'phase': phase,
@@ -7191,19 +7401,13 @@ def referral_claim_quest():
 
         # Pay out
         reward = quest['reward']
-        S.wallets[addr]['balance'] = S.wallets[addr].get('balance', 0) + reward
+        wallet = S.wallets[addr]
+        wallet['balance'] = wallet.get('balance', 0) + reward
         claimed.add(quest_id)
         referral['quests_claimed'] = list(claimed)
 
-        S.mempool.append({
-            'type': 'referral_quest',
-            'from': 'referral_system',
-            'to': _ref_anon_id(addr),
-            'amount': reward,
-            'quest_id': quest_id,
-            'quest_label': quest['label'],
-            'timestamp': int(time.time()),
-        })
+        S.mempool.append(_referral_tx('referral_quest', addr, reward, int(time.time()),
+                                      quest_id=quest_id, quest_label=quest['label']))
         # Save referrals SYNCHRONOUSLY to prevent double-claim between requests
         try:
             import json as _json
@@ -7211,7 +7415,7 @@ def referral_claim_quest():
             ref_file = _Path('data/referrals.json')
             ref_file.parent.mkdir(exist_ok=True)
             with open(ref_file, 'w') as _f:
-                _json.dump({'codes': S.referrals, 'map': S.referral_map}, _f)
+                _json.dump(S._referrals_json(), _f)
         except Exception as _e:
             print(f"⚠️ referrals save error: {_e}")
         S.save()
@@ -7220,7 +7424,7 @@ def referral_claim_quest():
             'ok': True,
             'quest_id': quest_id,
             'reward': reward,
-            'balance': S.wallets[addr]['balance'],
+            'balance': wallet['balance'],
         })
 
 @app.route('/api/referral/leaderboard', methods=['GET'])
@@ -7228,67 +7432,68 @@ def referral_leaderboard():
     """Anonymous referral leaderboard"""
     with S.lock:
         phase = get_referral_phase()
-        board = []
-        for code, data in S.referrals.items():
-            count = len(data.get('used_by', []))
-            if count == 0:
-                continue
+        totals = [0, 0]  # referrers, referrals — filled during the single pass
+
+        def active_codes():
+            for code, data in S.referrals.items():
+                count = len(data.get('used_by', ()))
+                if count:
+                    totals[0] += 1
+                    totals[1] += count
+                    yield count, code, data
+
+        # Partial top-50 selection; L1/L2/L3 tree counts only for the winners
+        top = []
+        for count, code, data in heapq.nlargest(50, active_codes(), key=lambda x: x[0]):
             l1, l2, l3 = _get_ref_counts(code)
-            quests_done = len(data.get('quests_claimed', []))
-            board.append({
+            top.append({
                 'code': (data.get('vanity') or code[:6] + '**'),
                 'total': count,
                 'l1': l1, 'l2': l2, 'l3': l3,
-                'quests': quests_done,
+                'quests': len(data.get('quests_claimed', [])),
             })
 
-        board.sort(key=lambda x: -x['total'])
-        return jsonify({
+        return _json_response({
             'ok': True,
             'phase': phase,
             'total_wallets': len(S.wallets),
-            'total_referrers': len(board),
-            'total_referrals': sum(b['total'] for b in board),
-            'top': board[:50],
+            'total_referrers': totals[0],
+            'total_referrals': totals[1],
+            'top': top,
         })
 
 
+SAVE_FLUSH_INTERVAL = 0.1  # seconds — coalescing window for the background flush
+SAVE_RETRY_MAX = 30.0      # seconds — backoff cap while save_sync() keeps failing
+_save_event = _threading.Event()
+
 def _schedule_save():
-    global _save_dirty
-    _save_dirty = True
-    try:
-        _save_queue.put_nowait(True)
-    except Exception:
-        pass  # Already queued
+    """Mark state dirty — the bg-save thread flushes it within SAVE_FLUSH_INTERVAL"""
+    _save_event.set()
 
 def _bg_save_worker():
     """Background thread: coalesces rapid saves into one disk write"""
-    import time as _t
-    _last_chain_len = [0]
+    failures = 0
     while True:
+        _save_event.wait()
+        # Let the rest of a burst of handler saves land before writing;
+        # back off (doubling, capped) while the disk keeps failing
+        _time.sleep(min(SAVE_FLUSH_INTERVAL * (1 << min(failures, 16)), SAVE_RETRY_MAX))
+        _save_event.clear()
         try:
-            _save_queue.get(timeout=2)
-            # Drain all queued saves (coalesce)
-            while True:
-                try: _save_queue.get_nowait()
-                except: break
-            # Small delay to catch any more queued saves
-            _t.sleep(0.05)
-            while True:
-                try: _save_queue.get_nowait()
-                except: break
-            # Actually write
-            try:
-                S.save_sync()
-                _last_chain_len[0] = len(S.chain) if S else 0
-            except Exception as e:
-                print(f'⚠️ BG save error: {e}')
-        except Exception:
-            pass  # Timeout — no pending save
+            S.save_sync()
+        except Exception as e:
+            if not failures:  # log once per failure streak (disk full, permissions...)
+                print(f'⚠️ BG save error: {e} — retrying with backoff')
+            failures += 1
+            _save_event.set()  # state still dirty — retry
+        else:
+            if failures:
+                print(f'✅ BG save recovered after {failures} failed attempts')
+            failures = 0
 
 def _start_bg_save():
-    import threading
-    t = threading.Thread(target=_bg_save_worker, daemon=True, name='bg-save')
+    t = _threading.Thread(target=_bg_save_worker, daemon=True, name='bg-save')
     t.start()
 
 
@@ -7676,13 +7881,35 @@ def pet_release(): return wraith_release()
 def pol_zones():
     """List all available PoL zones"""
     _pz_cached = _cache_get('pol:zones')
-    if _pz_cached: return jsonify(_pz_cached)
+    if _pz_cached: return _json_response(_pz_cached)
     if not POL_AVAILABLE:
-        return jsonify({'ok': False, 'error': 'Proof-of-Location not available'}), 503
-    zones = ProofOfLocation.get_available_zones()
-    zones['ok'] = True
+        return _json_response({'ok': False, 'error': 'Proof-of-Location not available'}), 503
+    zones = dict(ProofOfLocation.get_available_zones(), ok=True)
     _cache_set('pol:zones', zones, ttl=120)
-    return jsonify(zones)
+    return _json_response(zones)
+
+def _resolve_coords(data, missing_error):
+    """
+    Shared PoL request preamble → ((lat, lon), None) or (None, error response).
+    manual=true with a zone uses the zone's center instead of GPS coordinates.
+    """
+    lat = data.get('lat')
+    lon = data.get('lon')
+    zone = data.get('zone')
+    
+    if data.get('manual', False) and zone:
+        bounds = ALL_ZONES.get(zone)
+        if bounds is None:
+            return None, (_json_response({'ok': False, 'error': f'Unknown zone: {zone}'}), 400)
+        lat = (bounds['lat_min'] + bounds['lat_max']) / 2
+        lon = (bounds['lon_min'] + bounds['lon_max']) / 2
+    elif lat is None or lon is None:
+        return None, (_json_response({'ok': False, 'error': missing_error}), 400)
+    
+    try:
+        return (float(lat), float(lon)), None
+    except (ValueError, TypeError):
+        return None, (_json_response({'ok': False, 'error': 'Invalid coordinates'}), 400)
 
 @app.route('/api/pol/prove', methods=['POST'])
 def pol_prove():
@@ -7692,39 +7919,24 @@ def pol_prove():
     Coordinates are NEVER stored on server.
     """
     if not POL_AVAILABLE:
-        return jsonify({'ok': False, 'error': 'PoL not available'}), 503
+        return _json_response({'ok': False, 'error': 'PoL not available'}), 503
     
     seed = request.headers.get('X-Seed', '').strip()
     if not validate_seed(seed):
-        return jsonify({'ok': False, 'error': 'Unauthorized'}), 401
+        return _json_response({'ok': False, 'error': 'Unauthorized'}), 401
     
     data = request.get_json() or {}
-    lat = data.get('lat')
-    lon = data.get('lon')
     zone = data.get('zone')  # optional: specific zone to prove
-    manual = data.get('manual', False)  # manual mode: zone-only, no GPS coords
-    
-    if manual and zone:
-        # Manual mode: use zone center coordinates
-        from lac_proof_of_location import ALL_ZONES
-        if zone not in ALL_ZONES:
-            return jsonify({'ok': False, 'error': f'Unknown zone: {zone}'}), 400
-        bounds = ALL_ZONES[zone]
-        lat = (bounds['lat_min'] + bounds['lat_max']) / 2
-        lon = (bounds['lon_min'] + bounds['lon_max']) / 2
-    elif lat is None or lon is None:
-        return jsonify({'ok': False, 'error': 'lat and lon required (or use manual=true with zone)'}), 400
     
-    try:
-        lat = float(lat)
-        lon = float(lon)
-    except (ValueError, TypeError):
-        return jsonify({'ok': False, 'error': 'Invalid coordinates'}), 400
+    coords, err = _resolve_coords(data, 'lat and lon required (or use manual=true with zone)')
+    if err:
+        return err
+    lat, lon = coords
     
     result = ProofOfLocation.create_proof(lat, lon, zone)
     
     if not result.get('valid'):
-        return jsonify({'ok': False, 'error': result.get('error', 'Unknown zone'), 'zones': result.get('actual_zones', [])})
+        return _json_response({'ok': False, 'error': result.get('error', 'Unknown zone'), 'zones': result.get('actual_zones', [])})
     
     # Store proof on-chain (PUBLIC part only — NO coordinates)
     addr = get_address_from_seed(seed)
@@ -7732,7 +7944,7 @@ def pol_prove():
     
     with S.lock:
         if addr not in S.wallets:
-            return jsonify({'ok': False, 'error': 'Wallet not found'}), 404
+            return _json_response({'ok': False, 'error': 'Wallet not found'}), 404
         
         wallet = S.wallets[addr]
         
@@ -7753,7 +7965,7 @@ def pol_prove():
         S.mempool.append(tx)
         S.save()
     
-    return jsonify({
+    return _json_response({
         'ok': True,
         'proof': proof_public,
         # Private data returned to device only — client should store locally
@@ -7765,17 +7977,17 @@ def pol_prove():
 def pol_verify():
     """Verify a Proof-of-Location"""
     if not POL_AVAILABLE:
-        return jsonify({'ok': False, 'error': 'PoL not available'}), 503
+        return _json_response({'ok': False, 'error': 'PoL not available'}), 503
     
     data = request.get_json() or {}
     proof = data.get('proof', {})
     
     if not proof:
-        return jsonify({'ok': False, 'error': 'proof object required'}), 400
+        return _json_response({'ok': False, 'error': 'proof object required'}), 400
     
     result = ProofOfLocation.verify_proof(proof)
     result['ok'] = result.get('valid', False)
-    return jsonify(result)
+    return _json_response(result)
 
 @app.route('/api/pol/message', methods=['POST'])
 def pol_message():
@@ -7784,55 +7996,41 @@ def pol_message():
     Journalist use case: prove you're in a zone without revealing exact location.
     """
     if not POL_AVAILABLE:
-        return jsonify({'ok': False, 'error': 'PoL not available'}), 503
+        return _json_response({'ok': False, 'error': 'PoL not available'}), 503
     
     seed = request.headers.get('X-Seed', '').strip()
     if not validate_seed(seed):
-        return jsonify({'ok': False, 'error': 'Unauthorized'}), 401
+        return _json_response({'ok': False, 'error': 'Unauthorized'}), 401
     
     data = request.get_json() or {}
-    lat = data.get('lat')
-    lon = data.get('lon')
     text = data.get('text', '').strip()
     to = data.get('to', '').strip()
     zone = data.get('zone')
-    manual = data.get('manual', False)
     
     if not text:
-        return jsonify({'ok': False, 'error': 'text required'}), 400
+        return _json_response({'ok': False, 'error': 'text required'}), 400
     
-    if manual and zone:
-        from lac_proof_of_location import ALL_ZONES
-        if zone not in ALL_ZONES:
-            return jsonify({'ok': False, 'error': f'Unknown zone: {zone}'}), 400
-        bounds = ALL_ZONES[zone]
-        lat = (bounds['lat_min'] + bounds['lat_max']) / 2
-        lon = (bounds['lon_min'] + bounds['lon_max']) / 2
-    elif lat is None or lon is None:
-        return jsonify({'ok': False, 'error': 'lat, lon, and text required (or use manual=true with zone)'}), 400
-    
-    try:
-        lat = float(lat)
-        lon = float(lon)
-    except (ValueError, TypeError):
-        return jsonify({'ok': False, 'error': 'Invalid coordinates'}), 400
+    coords, err = _resolve_coords(data, 'lat, lon, and text required (or use manual=true with zone)')
+    if err:
+        return err
+    lat, lon = coords
     
     result = ProofOfLocation.create_message_proof(lat, lon, text, zone)
     
     if not result.get('valid'):
-        return jsonify({'ok': False, 'error': result.get('error', 'Unknown zone')})
+        return _json_response({'ok': False, 'error': result.get('error', 'Unknown zone')})
     
     addr = get_address_from_seed(seed)
     proof_public = result['public']
     
     with S.lock:
         if addr not in S.wallets:
-            return jsonify({'ok': False, 'error': 'Wallet not found'}), 404
+            return _json_response({'ok': False, 'error': 'Wallet not found'}), 404
         
         wallet = S.wallets[addr]
         
         if wallet.get('balance', 0) < MIN_MSG_FEE:
-            return jsonify({'ok': False, 'error': f'Need {MIN_MSG_FEE} LAC'}), 400
+            return _json_response({'ok': False, 'error': f'Need {MIN_MSG_FEE} LAC'}), 400
         
         key_id = wallet.get('key_id')
         from_username = get_username_by_key_id(key_id)
@@ -7865,9 +8063,9 @@ def pol_message():
         wallet['msg_count'] = wallet.get('msg_count', 0) + 1
         S.save_msgs()
     
-    return jsonify({
+    return _json_response({
         'ok': True,
-        'message_id': hashlib.sha256(json.dumps(msg).encode()).hexdigest()[:16],
+        'message_id': hashlib.sha256(f"{addr}|{msg['timestamp']}|{text}".encode()).hexdigest()[:16],
         'proof': proof_public,
         'zone': proof_public['zone'],
         'balance': wallet.get('balance', 0),
@@ -7877,17 +8075,110 @@ def pol_message():
 def pol_detect():
     """Detect which zones contain given coordinates (no proof, just detection)"""
     if not POL_AVAILABLE:
-        return jsonify({'ok': False, 'error': 'PoL not available'}), 503
+        return _json_response({'ok': False, 'error': 'PoL not available'}), 503
     
     data = request.get_json() or {}
     try:
         lat = float(data.get('lat', 0))
         lon = float(data.get('lon', 0))
     except (ValueError, TypeError):
-        return jsonify({'ok': False, 'error': 'Invalid coordinates'}), 400
+        return _json_response({'ok': False, 'error': 'Invalid coordinates'}), 400
     
     zones = ProofOfLocation.detect_zones(lat, lon)
-    return jsonify({'ok': True, 'zones': zones, 'count': len(zones)})
+    return _json_response({'ok': True, 'zones': zones, 'count': len(zones)})
+
+# Username burn cost by length (anything else: 10 LAC) — /api/stats fallback estimate
+USERNAME_COSTS = {3: 10000, 4: 1000, 5: 100}
+_UNAME_COST_TBL = tuple(USERNAME_COSTS.get(i, 10) for i in range(64))  # indexed by len(username)
+
+# Total LAC burned to reach each level (sum of upgrade costs)
+LEVEL_CUMULATIVE = {0:0, 1:100, 2:800, 3:2800, 4:12800, 5:112800, 6:612800, 7:2612800}
+
+# TX type → /api/stats counter bucket (exact match first, then prefix)
+TX_TYPE_BUCKET = {
+    'transfer': 'normal', 'normal': 'normal',
+    'veil_transfer': 'veil',
+    'stash_deposit': 'stash', 'stash_withdraw': 'stash',
+    'dice_burn': 'dice', 'dice_mint': 'dice',
+    'timelock_create': 'timelock',
+    'username_register': 'username',
+    'faucet': 'faucet',
+}
+TX_PREFIX_BUCKETS = (('dms_', 'dms'), ('burn_', 'burn'))
+
+def _new_stats_cache():
+    return {
+        'last_block_scanned': -1,
+        'last_hash': None,
+        'tx_counts': {
+            'normal': 0, 'veil': 0, 'stash': 0, 'dice': 0,
+            'burn': 0, 'timelock': 0, 'dms': 0, 'username': 0, 'faucet': 0
+        },
+        'chain_faucet': 0,
+        'chain_referral': 0,
+        'chain_fees': 0,
+        'total_tx': 0,
+        'total_l2_msgs': 0,
+    }
+
+def _fold_chain_stats():
+    """
+    Fold blocks appended since the last call into S._stats_cache.
+    Caller holds S.lock. A changed hash at the last scanned height
+    (reorg / reload) resets the cache and rescans from genesis.
+    """
+    cache = S._stats_cache
+    last = cache['last_block_scanned']
+    if last >= len(S.chain) or (last >= 0 and S.chain[last].get('hash') != cache['last_hash']):
+        cache = S._stats_cache = _new_stats_cache()
+        last = -1
+    
+    tx_counts = cache['tx_counts']
+    for b in S.chain[last + 1:]:
+        cache['total_l2_msgs'] += len(b.get('ephemeral_msgs', []))
+        txs = b.get('transactions', [])
+        cache['total_tx'] += len(txs)
+        
+        for tx in txs:
+            fee = tx.get('fee', 0) or 0
+            if fee > 0:
+                cache['chain_fees'] += fee
+            t = tx.get('type', '')
+            bucket = TX_TYPE_BUCKET.get(t)
+            if bucket is None:
+                bucket = next((bk for p, bk in TX_PREFIX_BUCKETS if t.startswith(p)), None)
+            if bucket:
+                tx_counts[bucket] += 1
+            
+            # Emission-carrying types
+            if t == 'faucet':
+                cache['chain_faucet'] += tx.get('amount', 0) or 0
+            elif t == 'referral_bonus':
+                cache['chain_referral'] += tx.get('amount', 0) or 0
+    
+    if S.chain:
+        cache['last_block_scanned'] = len(S.chain) - 1
+        cache['last_hash'] = S.chain[-1].get('hash')
+    return cache
+
+def _counters_active():
+    """
+    True once the event counters hold any activity. Counters only grow, so
+    the flag is sticky and the scan stops after the first positive result.
+    """
+    if not S._counters_active:
+        S._counters_active = sum(v for v in S.counters.values() if isinstance(v, (int, float))) > 0
+    return S._counters_active
+
+STATS_CACHE_TTL = 3  # seconds — /api/stats is polled far more often than it changes
+
+def _stats_response(entry):
+    """Pre-serialized /api/stats body with weak ETag; matching If-None-Match → 304"""
+    blob, etag = entry
+    resp = Response(blob, mimetype='application/json')
+    resp.set_etag(etag, weak=True)
+    resp.cache_control.max_age = STATS_CACHE_TTL
+    return resp.make_conditional(request)
 
 @app.route('/api/stats', methods=['GET'])
 def chain_stats():
@@ -7903,7 +8194,7 @@ def chain_stats():
     - total_burned = total_emitted - on_wallets - stash  ← DERIVED, always balances
     """
     cached = _cache_get('stats:chain')
-    if cached: return jsonify(cached)
+    if cached: return _stats_response(cached)
     try:
         with S.lock:
             total_wallets = len(S.wallets)
@@ -7914,16 +8205,45 @@ def chain_stats():
             else:
                 block_height = 0
             
+            # Counters track real-time events going forward
+            cnt = getattr(S, 'counters', {})
+            
+            # Wallet aggregates maintained at mutation sites (S.agg, rebuilt on load)
+            agg = S.agg
+            wallet_burned_username = agg['username_burn']
+            dice_games = agg['dice_games']
+            dms_active = agg['dms_active']
+            
+            # === Single wallet pass: balances + dice fallbacks ===
+            # Dice history is only walked game-by-game while the dice counters are empty
+            scan_dice = cnt.get('emitted_dice', 0) == 0 or cnt.get('burned_dice', 0) == 0
+            balances = []
+            wallet_dice_emitted = 0
+            wallet_dice_burned = 0
+            _append = balances.append
+            for w in S.wallets.values():
+                _append(w.get('balance', 0))
+                if scan_dice:
+                    for game in w.get('dice_history', ()):
+                        if game.get('won'):
+                            wallet_dice_emitted += game.get('payout', 0) - game.get('amount', 0)
+                        else:
+                            wallet_dice_burned += game.get('amount', 0)
+            
             # === GROUND TRUTH #1: Wallet balances ===
-            balances = sorted([w.get('balance', 0) for w in S.wallets.values()], reverse=True)
+            top_balances = heapq.nlargest(10, balances)
             on_wallets = round(sum(balances), 2)
             stash_balance = round(S.stash_pool.get('total_balance', 0), 2)
             
-            # === GROUND TRUTH #2: Level distribution ===
+            # === GROUND TRUTH #2: Level distribution (maintained in S.agg) ===
+            level_counts = S.agg['level_counts']
             levels = {}
-            for w in S.wallets.values():
-                lv = w.get('level', 0)
-                levels[f"L{lv}"] = levels.get(f"L{lv}", 0) + 1
+            l0 = total_wallets - sum(level_counts.values())
+            if l0 > 0:
+                levels['L0'] = l0
+            for lv in sorted(level_counts):
+                if level_counts[lv] > 0:
+                    levels[f"L{lv}"] = level_counts[lv]
         
 
             
@@ -7934,61 +8254,22 @@ def chain_stats():
             emitted_mining = round(block_height * BLOCK_REWARD, 2)
             
             # === EMISSION: Other sources (from counters + chain scan) ===
-            # Counters track real-time events going forward
-            cnt = getattr(S, 'counters', {})
-            
-            # Chain scan for TX types and supplemental emission data
-            chain_faucet = 0
-            chain_referral = 0
-            tx_counts = {
-                'normal': 0, 'veil': 0, 'stash': 0, 'dice': 0,
-                'burn': 0, 'timelock': 0, 'dms': 0, 'username': 0, 'faucet': 0
-            }
-            total_tx = 0
-            total_l2_msgs = 0
-            
-            for b in S.chain:
-                total_l2_msgs += len(b.get('ephemeral_msgs', []))
-                txs = b.get('transactions', [])
-                total_tx += len(txs)
-                
-                for tx in txs:
-                    t = tx.get('type', '')
-                    amt = tx.get('amount', 0) or 0
-                    
-                    if t in ('transfer', 'normal'):
-                        tx_counts['normal'] += 1
-                    elif t == 'veil_transfer':
-                        tx_counts['veil'] += 1
-                    elif t in ('stash_deposit', 'stash_withdraw'):
-                        tx_counts['stash'] += 1
-                    elif t in ('dice_burn', 'dice_mint'):
-                        tx_counts['dice'] += 1
-                    elif t == 'timelock_create':
-                        tx_counts['timelock'] += 1
-                    elif t.startswith('dms_'):
-                        tx_counts['dms'] += 1
-                    elif t == 'username_register':
-                        tx_counts['username'] += 1
-                    elif t == 'faucet':
-                        tx_counts['faucet'] += 1
-                        chain_faucet += amt
-                    elif t.startswith('burn_'):
-                        tx_counts['burn'] += 1
-                    elif t == 'referral_bonus':
-                        chain_referral += amt
+            # Chain aggregates — only blocks appended since the last call are scanned
+            chain_agg = _fold_chain_stats()
+            chain_faucet = chain_agg['chain_faucet']
+            chain_referral = chain_agg['chain_referral']
+            tx_counts = dict(chain_agg['tx_counts'])
+            total_tx = chain_agg['total_tx']
+            total_l2_msgs = chain_agg['total_l2_msgs']
             
             # Best estimate of non-mining emission
             emitted_faucet = max(cnt.get('emitted_faucet', 0), chain_faucet)
             emitted_dice = cnt.get('emitted_dice', 0)
             emitted_referral = max(cnt.get('emitted_referral', 0), chain_referral)
             
-            # If counters are empty (first deploy), scan dice history
+            # If counters are empty (first deploy), use the dice history totals
             if emitted_dice == 0:
-                for w in S.wallets.values():
-                    for game in w.get('dice_history', []):
-                        if game.get('won'):
-                            emitted_dice += game.get('payout', 0) - game.get('amount', 0)
+                emitted_dice = wallet_dice_emitted
             
             total_emitted = round(emitted_mining + emitted_faucet + emitted_dice + emitted_referral, 2)
             
@@ -8001,16 +8282,11 @@ def chain_stats():
             # total_burned is GROUND TRUTH — breakdown must never exceed it
 
             # DICE: counter + scan dice_history for losses if counter is empty
-            est_burned_dice = cnt.get('burned_dice', 0)
-            if est_burned_dice == 0:
-                for w in S.wallets.values():
-                    for game in w.get('dice_history', []):
-                        if not game.get('won'):
-                            est_burned_dice += game.get('amount', 0)
+            est_burned_dice = cnt.get('burned_dice', 0) or wallet_dice_burned
 
             # LEVELS: use counter if available; fallback to wallet-derived but cap at total_burned
-            LEVEL_CUMULATIVE = {0:0, 1:100, 2:800, 3:2800, 4:12800, 5:112800, 6:612800, 7:2612800}
-            wallet_burned_levels = sum(LEVEL_CUMULATIVE.get(w.get('level', 0), 0) for w in S.wallets.values())
+            # Derived from the level histogram (O(levels)); L0 contributes nothing
+            wallet_burned_levels = sum(LEVEL_CUMULATIVE.get(lv, 0) * c for lv, c in level_counts.items())
             cnt_burned_levels = cnt.get('burned_levels', 0)
             # Use counter if it looks sane (>0), else use wallet-derived capped at total_burned
             if cnt_burned_levels > 0:
@@ -8019,23 +8295,11 @@ def chain_stats():
                 est_burned_levels = min(wallet_burned_levels, total_burned)
 
             # USERNAMES: counter first, fallback wallet-derived
-            USERNAME_COSTS = {3: 10000, 4: 1000, 5: 100}
-            wallet_burned_username = 0
-            for w in S.wallets.values():
-                uname_w = w.get('username', '')
-                if uname_w and uname_w not in ('', 'Anonymous', 'None'):
-                    wallet_burned_username += USERNAME_COSTS.get(len(uname_w), 10)
             cnt_burned_username = cnt.get('burned_username', 0)
             est_burned_username = cnt_burned_username if cnt_burned_username > 0 else wallet_burned_username
 
-            # FEES: counter + chain scan fallback
-            est_burned_fees = cnt.get('burned_fees', 0)
-            if est_burned_fees == 0:
-                for b in S.chain:
-                    for tx in b.get('transactions', []):
-                        fee = tx.get('fee', 0) or 0
-                        if fee > 0:
-                            est_burned_fees += fee
+            # FEES: counter, else on-chain fee total folded in with the other chain aggregates
+            est_burned_fees = cnt.get('burned_fees', 0) or chain_agg['chain_fees']
 
             est_burned_dms = cnt.get('burned_dms', 0)
             est_burned_other = cnt.get('burned_other', 0)
@@ -8054,20 +8318,17 @@ def chain_stats():
                 historical_burns = 0
             
             # Supplement tx counts
-            dice_games = sum(len(w.get('dice_history', [])) for w in S.wallets.values())
             if tx_counts['dice'] == 0 and dice_games > 0:
                 tx_counts['dice'] = dice_games
             stash_ops = len(S.stash_pool.get('spent_nullifiers', [])) + len(S.stash_pool.get('deposits', {}))
             if tx_counts['stash'] == 0 and stash_ops > 0:
                 tx_counts['stash'] = stash_ops
             
-            dms_active = sum(1 for w in S.wallets.values() if w.get('dead_mans_switch', {}).get('enabled'))
-            
-            return jsonify({
+            stats = {
                 'ok': True,
                 'total_wallets': total_wallets,
                 'total_blocks': block_height,
-                'top_balances': [round(b, 2) for b in balances[:10]],
+                'top_balances': [round(b, 2) for b in top_balances],
                 'level_distribution': levels,
                 # === SUPPLY (always balances: emitted - burned = on_wallets + stash) ===
                 'on_wallets': on_wallets,
@@ -8103,10 +8364,16 @@ def chain_stats():
                 'dms_active': dms_active,
                 'active_sessions': len(S.active_sessions),
                 # === Counters status ===
-                'counters_active': sum(v for v in cnt.values() if isinstance(v, (int, float))) > 0,
-            })
+                'counters_active': _counters_active(),
+            }
+        
+        # Serialize once; repeated polls within the TTL reuse the bytes (new blocks invalidate)
+        blob = _json_bytes(stats)
+        entry = (blob, hashlib.blake2b(blob, digest_size=8).hexdigest())
+        _cache_set('stats:chain', entry, ttl=STATS_CACHE_TTL)
+        return _stats_response(entry)
     except Exception as e:
-        return jsonify({'ok': False, 'error': str(e)}), 500
+        return _json_response({'ok': False, 'error': str(e)}), 500
 
 # ── Gunicorn entry point ──────────────────────────────────────────────────
 # When running via gunicorn, main() is never called.
@@ -8132,6 +8399,7 @@ def _gunicorn_init():
         init_mining()
         Thread(target=auto_mining_loop, daemon=True).start()
         Thread(target=auto_cleanup, daemon=True).start()
+        _start_bg_save()
         print(f"[gunicorn] LAC ready — {len(S.chain)} blocks, {len(S.wallets)} wallets")
     except Exception as e:
         print(f"[gunicorn] Init warning: {e}")
@@ -15,9 +15,65 @@ Hybrid mining:
 import time
 import random
 import hashlib
+import struct
+from array import array
+import heapq
+import operator
+from bisect import bisect_right
+from itertools import accumulate
 import secrets
 from typing import Dict, List, Tuple, Optional
-from collections import defaultdict, Counter
+from collections import defaultdict, Counter, deque
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+    _rng = np.random.default_rng()  # lottery draws for large miner sets
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+    _rng = None
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        """No-op stand-in: kernels run as plain Python without numba"""
+        if args and callable(args[0]):
+            return args[0]
+        return lambda fn: fn
+
+
+@njit(cache=True)
+def _wait_kernel(levels, balances, recent_wins, rand, min_waits, max_waits,
+                 bal_thr, bal_bonus, domination_threshold, domination_penalty, out):
+    """
+    calculate_wait_time's arithmetic for a whole batch of miners → out[i]
+    
+    Randomness (keyed hash per address) is computed by the caller; this is
+    the numeric part only, so numba can compile it when installed.
+    """
+    max_level = len(min_waits) - 1
+    for i in range(len(levels)):
+        level = max(0, min(max_level, levels[i]))
+        lo = min_waits[level]
+        wait = lo + (max_waits[level] - lo) * rand[i]
+        
+        bonus = 0.0
+        for j in range(len(bal_thr) - 1, -1, -1):
+            if balances[i] >= bal_thr[j]:
+                bonus = bal_bonus[j]
+                break
+        wait *= 1.0 - bonus * 0.5
+        
+        wins = recent_wins[i]
+        if wins > domination_threshold:
+            wait *= min(1.0 + (wins - domination_threshold) * 0.1, domination_penalty)
+        out[i] = wait
+    return out
 
 
 class LACPoETMiningV3:
@@ -64,10 +120,16 @@ class LACPoETMiningV3:
         (1000, 0.05),   # 1k-9.9k LAC → +5%
         (50, 0.00),     # 50-999 LAC → +0%
     ]
+    # Ascending thresholds/bonuses for bisect lookup in get_balance_bonus
+    _BAL_THR = tuple(t for t, _ in sorted(BALANCE_BONUSES))
+    _BAL_BONUS = tuple(b for _, b in sorted(BALANCE_BONUSES))
     
     # Anti-pool
     MAX_WINS_PER_ADDRESS = 3  # in speed winners
     
+    # Lottery draws switch to numpy's Generator.choice from this many miners
+    LOTTERY_NUMPY_MIN_MINERS = 256
+    
     # Anti-domination (penalty for winning too much)
     DOMINATION_THRESHOLD = 20  # wins in last 100 blocks
     DOMINATION_PENALTY = 1.5   # wait_time multiplier
@@ -89,11 +151,13 @@ class LACPoETMiningV3:
         self.current_height = current_height
         self.difficulty = current_difficulty
         self.total_supply_mined = total_supply_mined
-        self.block_times = []
+        self.block_times = deque(maxlen=self.DIFFICULTY_ADJUSTMENT_INTERVAL)  # last interval only
         
         # Track wins for anti-domination
         self.recent_wins = defaultdict(int)  # address → wins in last 100 blocks
-        self.win_history = []  # [(block, address), ...]
+        self.win_history = deque()  # [(block, address), ...] oldest first
+        self._block_seed_for = None  # (block_hash, height) the cached seed belongs to
+        self._block_seed = b''
     
     def is_early_adopter_phase(self) -> bool:
         """Check if still in early adopter phase"""
@@ -105,10 +169,22 @@ class LACPoETMiningV3:
     
     def get_balance_bonus(self, balance: float) -> float:
         """Get balance bonus (PoS element)"""
-        for threshold, bonus in self.BALANCE_BONUSES:
-            if balance >= threshold:
-                return bonus
-        return 0.0
+        i = bisect_right(self._BAL_THR, balance) - 1
+        return self._BAL_BONUS[i] if i >= 0 else 0.0
+    
+    def _get_block_seed(self, block_hash: str) -> bytes:
+        """Per-block BLAKE2b key (block hash + height), derived once and reused for every miner"""
+        ident = (block_hash, self.current_height)
+        if self._block_seed_for != ident:
+            try:
+                key = bytes.fromhex(block_hash)
+            except ValueError:
+                key = block_hash.encode()
+            self._block_seed = hashlib.blake2b(
+                str(self.current_height).encode(), key=key[:64], digest_size=16
+            ).digest()
+            self._block_seed_for = ident
+        return self._block_seed
     
     def calculate_wait_time(
         self,
@@ -136,9 +212,8 @@ class LACPoETMiningV3:
         
         # Deterministic random in range
         if block_hash:
-            seed = f"{address}:{block_hash}:{self.current_height}"
-            seed_hash = hashlib.sha256(seed.encode()).digest()
-            random_value = int.from_bytes(seed_hash[:8], 'big') / (2**64)
+            h = hashlib.blake2b(address.encode(), key=self._get_block_seed(block_hash), digest_size=8).digest()
+            random_value = int.from_bytes(h, 'big') / (2**64)
         else:
             random_value = random.random()
         
@@ -158,6 +233,48 @@ class LACPoETMiningV3:
         
         return base_wait
     
+    def calculate_wait_times(
+        self,
+        levels,
+        balances,
+        addresses: List[str],
+        block_hash: str = None
+    ):
+        """
+        calculate_wait_time for a batch of miners (block replay / backtests)
+        
+        Runs _wait_kernel once over the batch — compiled when numba is
+        installed. Returns an ndarray with NumPy, else a list.
+        """
+        n = len(addresses)
+        if block_hash:
+            seed = self._get_block_seed(block_hash)
+            rand = [
+                int.from_bytes(hashlib.blake2b(a.encode(), key=seed, digest_size=8).digest(), 'big') / (2**64)
+                for a in addresses
+            ]
+        else:
+            rand = [random.random() for _ in range(n)]
+        recent = [self.recent_wins.get(a, 0) for a in addresses]
+        waits = [self.WAIT_TIMES[lv] for lv in range(self.MAX_LEVEL + 1)]
+        min_waits = [w[0] for w in waits]
+        max_waits = [w[1] for w in waits]
+        
+        if NUMPY_AVAILABLE:
+            f64 = np.float64
+            return _wait_kernel(
+                np.asarray(levels, dtype=np.int64), np.asarray(balances, dtype=f64),
+                np.asarray(recent, dtype=np.int64), np.asarray(rand, dtype=f64),
+                np.asarray(min_waits, dtype=f64), np.asarray(max_waits, dtype=f64),
+                np.asarray(self._BAL_THR, dtype=f64), np.asarray(self._BAL_BONUS, dtype=f64),
+                self.DOMINATION_THRESHOLD, self.DOMINATION_PENALTY, np.empty(n, dtype=f64)
+            )
+        return _wait_kernel(
+            list(levels), list(balances), recent, rand, min_waits, max_waits,
+            self._BAL_THR, self._BAL_BONUS,
+            self.DOMINATION_THRESHOLD, self.DOMINATION_PENALTY, [0.0] * n
+        )
+    
     def calculate_lottery_weight(
         self,
         level: int,
@@ -192,6 +309,47 @@ class LACPoETMiningV3:
         
         return weight
     
+    def lottery_weights(self, levels, balances, created_at):
+        """
+        calculate_lottery_weight over parallel columns (one entry per miner)
+        
+        Same formula: level bonus × balance bonus × newbie boost × early adopter boost.
+        With NumPy this is one array expression; otherwise a per-miner loop.
+        """
+        if not NUMPY_AVAILABLE:
+            # calculate_lottery_weight inlined; per-block invariants hoisted out of the loop
+            newbie_after = time.time() - self.NEWBIE_PERIOD
+            newbie_boost = self.NEWBIE_BOOST
+            early_mult = self.EARLY_ADOPTER_BOOST if self.is_early_adopter_phase() else 1.0
+            bal_thr, bal_bonus = self._BAL_THR, self._BAL_BONUS
+            weights = []
+            append = weights.append
+            for level, balance, created in zip(levels, balances, created_at):
+                i = bisect_right(bal_thr, balance) - 1
+                weight = (1.0 + level * 0.05) * (1.0 + (bal_bonus[i] if i >= 0 else 0.0) * 0.5)
+                if created and created > newbie_after:
+                    weight *= newbie_boost
+                append(weight * early_mult)
+            return weights
+        
+        levels = np.asarray(levels, dtype=np.float64)
+        balances = np.asarray(balances, dtype=np.float64)
+        created = np.fromiter((c or 0 for c in created_at), dtype=np.float64, count=len(levels))
+        
+        # Balance bonus: first threshold reached (BALANCE_BONUSES is high → low)
+        balance_bonus = np.select(
+            [balances >= threshold for threshold, _ in self.BALANCE_BONUSES],
+            [bonus for _, bonus in self.BALANCE_BONUSES],
+            default=0.0
+        )
+        
+        weights = (1.0 + levels * 0.05) * (1.0 + balance_bonus * 0.5)
+        newbie = (created != 0) & ((time.time() - created) < self.NEWBIE_PERIOD)
+        weights[newbie] *= self.NEWBIE_BOOST
+        if self.is_early_adopter_phase():
+            weights *= self.EARLY_ADOPTER_BOOST
+        return weights
+    
     def select_speed_winners(
         self,
         proofs: List[Dict],
@@ -205,9 +363,20 @@ class LACPoETMiningV3:
         if max_per_address is None:
             max_per_address = self.MAX_WINS_PER_ADDRESS
         
-        # Sort by elapsed time (fastest first)
-        sorted_proofs = sorted(proofs, key=lambda p: p['elapsed'])
+        # Fastest first — only the head of the order can ever win, so take a
+        # partial sort; a full sort is needed only if capped duplicates eat it
+        by_elapsed = operator.itemgetter('elapsed')
+        limit = self.SPEED_WINNERS * max_per_address
+        candidates = heapq.nsmallest(limit, proofs, key=by_elapsed)
+        
+        winners = self._pick_speed_winners(candidates, max_per_address)
+        if len(winners) < self.SPEED_WINNERS and len(proofs) > limit:
+            winners = self._pick_speed_winners(sorted(proofs, key=by_elapsed), max_per_address)
         
+        return winners
+    
+    def _pick_speed_winners(self, sorted_proofs: List[Dict], max_per_address: int) -> List[Dict]:
+        """Walk proofs fastest-first, capping wins per address"""
         winners = []
         address_wins = Counter()
         
@@ -252,15 +421,57 @@ class LACPoETMiningV3:
         if not eligible:
             return []
         
-        # Calculate weights
-        weights = []
-        for miner in eligible:
-            weight = self.calculate_lottery_weight(
-                miner['level'],
-                miner['balance'],
-                miner.get('account_created_at')
-            )
-            weights.append(weight)
+        picks = self._lottery_draw(
+            [m['address'] for m in eligible],
+            self.lottery_weights(
+                [m['level'] for m in eligible],
+                [m['balance'] for m in eligible],
+                [m.get('account_created_at') for m in eligible]
+            ),
+            exact_count
+        )
+        return [eligible[i] for i in picks]
+    
+    def select_lottery_addresses(
+        self,
+        addresses: List[str],
+        levels,
+        balances,
+        created_at,
+        exact_count: int = None
+    ) -> List[str]:
+        """
+        select_lottery_winners over column data (no exclusions) → winning addresses
+        
+        Used by LACMiningCoordinator, which keeps its miners column-wise.
+        """
+        if exact_count is None:
+            exact_count = self.LOTTERY_WINNERS
+        if not addresses:
+            return []
+        picks = self._lottery_draw(addresses, self.lottery_weights(levels, balances, created_at), exact_count)
+        return [addresses[i] for i in picks]
+    
+    def _lottery_draw(self, addresses: List[str], weights, exact_count: int) -> List[int]:
+        """Weighted draw of exact_count row indices with the per-address lottery cap"""
+        n = len(addresses)
+        if NUMPY_AVAILABLE and n >= self.LOTTERY_NUMPY_MIN_MINERS:
+            # Normalization + k draws in compiled code
+            w = np.asarray(weights, dtype=np.float64)
+            p = w / w.sum()
+            
+            def draw(k):
+                return _rng.choice(n, size=k, replace=True, p=p).tolist()
+        else:
+            # Cumulative weights once — every draw below is a bisect over them
+            if NUMPY_AVAILABLE:
+                cum_weights = np.cumsum(weights).tolist()
+            else:
+                cum_weights = list(accumulate(weights))
+            rows = range(n)
+            
+            def draw(k):
+                return random.choices(rows, cum_weights=cum_weights, k=k)
         
         # Weighted random selection WITHOUT replacement per block
         # Same address can win max 2 lottery slots (fair distribution)
@@ -271,49 +482,83 @@ class LACPoETMiningV3:
         max_attempts = exact_count * 10  # prevent infinite loop
 
         while len(winners) < exact_count and attempts < max_attempts:
-            attempts += 1
-            if not eligible:
-                break
-            # Pick one weighted
-            pick = random.choices(eligible, weights=weights, k=1)[0]
-            if addr_lottery_wins[pick['address']] < MAX_LOTTERY_WINS_PER_ADDR:
-                winners.append(pick)
-                addr_lottery_wins[pick['address']] += 1
-            # If we keep failing, relax the cap
-            if attempts > exact_count * 5:
-                MAX_LOTTERY_WINS_PER_ADDR = 3
+            # Draw as many picks as slots remain in one call; rejected picks
+            # (address over cap) count as attempts exactly as single draws did
+            batch = min(exact_count - len(winners), max_attempts - attempts)
+            for i in draw(batch):
+                attempts += 1
+                address = addresses[i]
+                if addr_lottery_wins[address] < MAX_LOTTERY_WINS_PER_ADDR:
+                    winners.append(i)
+                    addr_lottery_wins[address] += 1
+                # If we keep failing, relax the cap
+                if attempts > exact_count * 5:
+                    MAX_LOTTERY_WINS_PER_ADDR = 3
 
         # Fallback: fill remaining with any miner
-        if len(winners) < exact_count and eligible:
+        if len(winners) < exact_count:
             needed = exact_count - len(winners)
-            extra = random.choices(eligible, weights=weights, k=needed)
-            winners.extend(extra)
+            winners.extend(draw(needed))
 
         return winners
     
     def update_win_history(self, winners: List[str]):
         """Update win tracking for anti-domination"""
+        history = self.win_history
+        recent = self.recent_wins
+        
         # Add new wins
+        height = self.current_height
         for address in winners:
-            self.win_history.append((self.current_height, address))
-            self.recent_wins[address] += 1
+            history.append((height, address))
+            recent[address] += 1
         
-        # Remove wins older than 100 blocks
-        cutoff_block = self.current_height - 100
-        self.win_history = [
-            (block, addr) for block, addr in self.win_history
-            if block > cutoff_block
-        ]
+        # Expire wins older than 100 blocks (history is in block order)
+        cutoff_block = height - 100
+        while history and history[0][0] <= cutoff_block:
+            _, addr = history.popleft()
+            recent[addr] -= 1
+            if recent[addr] <= 0:
+                del recent[addr]
+    
+    WIN_HISTORY_MAGIC = b'LACW1'
+    
+    def win_history_bytes(self) -> bytes:
+        """
+        win_history as compact binary (node-local state, never sent over the wire)
         
-        # Recalculate recent wins
-        self.recent_wins = Counter([addr for _, addr in self.win_history])
+        Layout: magic | u32 count | count × int64 heights | NUL-joined UTF-8 addresses
+        """
+        heights = array('q', (b for b, _ in self.win_history))
+        addresses = '\0'.join(a for _, a in self.win_history).encode()
+        return self.WIN_HISTORY_MAGIC + struct.pack('<I', len(heights)) + heights.tobytes() + addresses
+    
+    def load_win_history_bytes(self, blob: bytes) -> bool:
+        """Restore from win_history_bytes() output; False if the blob is not recognised"""
+        magic = self.WIN_HISTORY_MAGIC
+        if not blob.startswith(magic):
+            return False
+        offset = len(magic)
+        (count,) = struct.unpack_from('<I', blob, offset)
+        offset += 4
+        heights = array('q')
+        heights.frombytes(blob[offset:offset + count * heights.itemsize])
+        addresses = blob[offset + count * heights.itemsize:].decode().split('\0') if count else []
+        if len(heights) != count or len(addresses) != count:
+            return False
+        self.load_win_history(zip(heights, addresses))
+        return True
+    
+    def load_win_history(self, entries):
+        """Restore persisted [(block, address), ...] and rebuild recent win counts"""
+        cutoff_block = self.current_height - 100
+        self.win_history = deque((b, a) for b, a in entries if b > cutoff_block)
+        self.recent_wins = defaultdict(int, Counter(a for _, a in self.win_history))
     
     def calculate_rewards(self, winners: List[str]) -> Dict[str, float]:
         """Calculate rewards (same address can win multiple times)"""
-        rewards = defaultdict(float)
-        for address in winners:
-            rewards[address] += self.REWARD_PER_WINNER
-        return dict(rewards)
+        reward = self.REWARD_PER_WINNER
+        return {address: wins * reward for address, wins in Counter(winners).items()}
     
     def adjust_difficulty(self, recent_block_times: List[float]) -> float:
         """Adjust difficulty to maintain target block time"""
@@ -331,14 +576,32 @@ class LACPoETMiningV3:
 
 
 class LACMiningCoordinator:
-    """Coordinates mining with Speed + Lottery system"""
+    """
+    Coordinates mining with Speed + Lottery system
+    
+    Active miners are stored column-wise (one list per field, one row per
+    miner, row located via _addr_idx) so per-block weight math reads whole
+    columns instead of chasing one dict per miner.
+    """
+    
+    MINER_FIELDS = ('address', 'level', 'balance', 'account_created_at', 'wait_time', 'registered_at')
     
     def __init__(self, poet: LACPoETMiningV3):
         self.poet = poet
-        self.active_miners = {}  # address → miner data
+        self.miners = {f: [] for f in self.MINER_FIELDS}  # column → values (row = miner)
+        self._addr_idx = {}  # address → row in self.miners
         self.submitted_proofs = []  # proofs for current block
         self.last_block_time = time.time()
     
+    @property
+    def active_miners(self) -> Dict[str, Dict]:
+        """address → miner data (row snapshot; writes do not reach the columns)"""
+        cols = [self.miners[f] for f in self.MINER_FIELDS]
+        return {
+            row[0]: dict(zip(self.MINER_FIELDS, row))
+            for row in zip(*cols)
+        }
+    
     def register_miner(
         self,
         address: str,
@@ -353,16 +616,17 @@ class LACMiningCoordinator:
                 'reason': f'Need {self.poet.MIN_BALANCE_FOR_MINING} LAC minimum'
             }
         
-        self.active_miners[address] = {
-            'address': address,
-            'level': level,
-            'balance': balance,
-            'account_created_at': account_created_at or time.time(),
-            'wait_time': self.poet.calculate_wait_time(
-                level, balance, address, account_created_at
-            ),
-            'registered_at': time.time()
-        }
+        wait_time = self.poet.calculate_wait_time(
+            level, balance, address, account_created_at
+        )
+        self._put_row((
+            address,
+            level,
+            balance,
+            account_created_at or time.time(),
+            wait_time,
+            time.time()
+        ))
         
         lottery_weight = self.poet.calculate_lottery_weight(
             level, balance, account_created_at
@@ -370,28 +634,72 @@ class LACMiningCoordinator:
         
         return {
             'mining': True,
-            'wait_time': self.active_miners[address]['wait_time'],
+            'wait_time': wait_time,
             'lottery_weight': lottery_weight,
-            'message': f"⛏️ Mining! Wait: {self.active_miners[address]['wait_time']:.1f}s"
+            'message': f"⛏️ Mining! Wait: {wait_time:.1f}s"
         }
     
+    def register_miners_bulk(
+        self,
+        addresses: List[str],
+        levels,
+        balances,
+        created_ats
+    ) -> List[str]:
+        """
+        Register a batch of miners (parallel columns) → addresses accepted
+        
+        The minimum-balance check is one mask over the batch; wait times for
+        the survivors come from calculate_wait_times in a single pass.
+        """
+        min_balance = self.poet.MIN_BALANCE_FOR_MINING
+        if NUMPY_AVAILABLE:
+            ok = np.flatnonzero(np.asarray(balances, dtype=np.float64) >= min_balance).tolist()
+        else:
+            ok = [i for i, balance in enumerate(balances) if balance >= min_balance]
+        if not ok:
+            return []
+        
+        addrs = [addresses[i] for i in ok]
+        lvls = [levels[i] for i in ok]
+        bals = [balances[i] for i in ok]
+        waits = self.poet.calculate_wait_times(lvls, bals, addrs)
+        now = time.time()
+        for j, i in enumerate(ok):
+            self._put_row((addrs[j], lvls[j], bals[j], created_ats[i] or now, float(waits[j]), now))
+        return addrs
+    
+    def _put_row(self, row: Tuple):
+        """Append a miner row, or overwrite the address's existing row"""
+        miners = self.miners
+        idx = self._addr_idx.get(row[0])
+        if idx is None:
+            self._addr_idx[row[0]] = len(miners['address'])
+            for f, value in zip(self.MINER_FIELDS, row):
+                miners[f].append(value)
+        else:
+            for f, value in zip(self.MINER_FIELDS, row):
+                miners[f][idx] = value
+    
     def submit_proof(self, address: str) -> Optional[Dict]:
         """Miner submits proof after waiting"""
-        if address not in self.active_miners:
+        idx = self._addr_idx.get(address)
+        if idx is None:
             return None
         
-        miner = self.active_miners[address]
-        elapsed = time.time() - miner['registered_at']
+        miners = self.miners
+        wait_time = miners['wait_time'][idx]
+        elapsed = time.time() - miners['registered_at'][idx]
         
         # Must wait minimum time
-        if elapsed < miner['wait_time']:
+        if elapsed < wait_time:
             return None
         
         proof = {
             'address': address,
-            'level': miner['level'],
-            'balance': miner['balance'],
-            'wait_time': miner['wait_time'],
+            'level': miners['level'][idx],
+            'balance': miners['balance'][idx],
+            'wait_time': wait_time,
             'elapsed': elapsed,
             'timestamp': time.time()
         }
@@ -409,17 +717,18 @@ class LACMiningCoordinator:
         # Calculate how many lottery winners we need to reach 19 total
         lottery_needed = self.poet.WINNERS_PER_BLOCK - speed_count
         
-        # Select Lottery winners to fill remaining slots
-        all_miners = list(self.active_miners.values())
-        lottery_winners = self.poet.select_lottery_winners(
-            all_miners,
-            exclude_addresses=set(),
+        # Select Lottery winners to fill remaining slots (straight from the columns)
+        miners = self.miners
+        lottery_winners = self.poet.select_lottery_addresses(
+            miners['address'],
+            miners['level'],
+            miners['balance'],
+            miners['account_created_at'],
             exact_count=lottery_needed
         )
         
         # Combine winners
-        all_winners = [w['address'] for w in speed_winners] + \
-                      [w['address'] for w in lottery_winners]
+        all_winners = [w['address'] for w in speed_winners] + lottery_winners
         
         # Calculate rewards
         rewards = self.poet.calculate_rewards(all_winners)
@@ -436,9 +745,7 @@ class LACMiningCoordinator:
         # Adjust difficulty if needed
         if self.poet.current_height % self.poet.DIFFICULTY_ADJUSTMENT_INTERVAL == 0:
             old_diff = self.poet.difficulty
-            self.poet.difficulty = self.poet.adjust_difficulty(
-                self.poet.block_times[-self.poet.DIFFICULTY_ADJUSTMENT_INTERVAL:]
-            )
+            self.poet.difficulty = self.poet.adjust_difficulty(self.poet.block_times)
             difficulty_adjusted = True
         else:
             difficulty_adjusted = False
@@ -458,7 +765,7 @@ class LACMiningCoordinator:
             'rewards': rewards,
             'total_reward': sum(rewards.values()),
             'proofs_submitted': len(self.submitted_proofs),
-            'active_miners': len(self.active_miners),
+            'active_miners': len(self._addr_idx),
             'difficulty': self.poet.difficulty,
             'difficulty_adjusted': difficulty_adjusted,
             'early_adopter_phase': self.poet.is_early_adopter_phase()
@@ -467,7 +774,8 @@ class LACMiningCoordinator:
         # Reset for next block
         self.poet.current_height += 1
         self.submitted_proofs = []
-        self.active_miners = {}
+        self.miners = {f: [] for f in self.MINER_FIELDS}
+        self._addr_idx = {}
         
         return block
 
@@ -519,11 +827,11 @@ if __name__ == '__main__':
     print(f"\n⏳ Simulating mining...")
     time.sleep(0.1)
     for addr, level, _, _ in miners:
-        miner_data = coordinator.active_miners.get(addr)
-        if miner_data:
+        idx = coordinator._addr_idx.get(addr)
+        if idx is not None:
             # Simulate that they waited (fake for demo)
-            elapsed = miner_data['wait_time'] + random.uniform(0, 2)
-            miner_data['registered_at'] = time.time() - elapsed
+            elapsed = coordinator.miners['wait_time'][idx] + random.uniform(0, 2)
+            coordinator.miners['registered_at'][idx] = time.time() - elapsed
             coordinator.submit_proof(addr)
     
     # Mine block
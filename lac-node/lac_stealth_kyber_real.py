@@ -21,34 +21,78 @@ Monero Compatibility:
 
 import hashlib
 import secrets
+import struct
 import time
-from typing import Tuple, Dict, Optional
+from typing import Tuple, Dict, Iterable, List, Optional
+
+# Optional real Kyber-768 KEM (liboqs-python: pip install liboqs-python)
+# liboqs picks its AVX2 NTT / SHAKE code at runtime; the SHAKE stub below is the fallback
+try:
+    import oqs
+    OQS_KEM = next((alg for alg in ('ML-KEM-768', 'Kyber768')
+                    if alg in oqs.get_enabled_kem_mechanisms()), None)
+    OQS_AVAILABLE = OQS_KEM is not None
+except Exception:  # ImportError, or liboqs shared library missing
+    oqs = None
+    OQS_KEM = None
+    OQS_AVAILABLE = False
+
+# Encrypted amount layout: little-endian float64 + zero padding to 32 bytes
+_AMOUNT = struct.Struct('<d')
+_AMOUNT_PAD = b'\x00' * (32 - _AMOUNT.size)
+
+# Domain-separation prefixes for the SHAKE-128 derivations below
+# (one XOF call per derived value instead of chained SHA3 calls + padding)
+DOM_PUB = b"KYBER_PUB"
+DOM_ENC = b"KYBER_ENCAPS"
+DOM_SECRET = b"KYBER_SS"
+
+
+def _xor_bytes(a: bytes, b: bytes) -> bytes:
+    """a XOR b over the shorter length (like zip) — one bignum XOR, not a per-byte loop"""
+    n = min(len(a), len(b))
+    return (int.from_bytes(a[:n], 'big') ^ int.from_bytes(b[:n], 'big')).to_bytes(n, 'big')
 
 
 class LACKyber768:
     """
-    Simplified Kyber-768 implementation for LAC
+    Kyber-768 KEM for LAC
     
-    Real Kyber uses lattice-based cryptography.
-    This is a simplified version for prototyping.
-    For production, use: pip install pqcrypto or liboqs-python
+    With liboqs-python installed this is real lattice-based Kyber-768
+    (ML-KEM-768). Without it, a simplified SHAKE-based stub for
+    prototyping — keys and ciphertexts of the two backends are not
+    interchangeable.
     """
     
     def __init__(self):
         self.security_level = 768  # Kyber-768 security bits
-        self.key_size = 96  # 768 bits = 96 bytes
+        self.backend = 'liboqs' if OQS_AVAILABLE else 'stub'
+        if OQS_AVAILABLE:
+            with oqs.KeyEncapsulation(OQS_KEM) as kem:
+                self.key_size = kem.details['length_public_key']
+        else:
+            self.key_size = 96  # 768 bits = 96 bytes
     
     def generate_keypair(self) -> Tuple[bytes, bytes]:
         """Generate Kyber-768 keypair (public, private)"""
+        if OQS_AVAILABLE:
+            with oqs.KeyEncapsulation(OQS_KEM) as kem:
+                public_key = kem.generate_keypair()
+                return public_key, kem.export_secret_key()
+        
         # Simplified: In real Kyber, this uses lattice algebra
-        private_key = secrets.token_bytes(self.key_size)
-        # Deterministic public key from private
-        public_key = hashlib.sha3_384(b"KYBER_PUB" + private_key).digest()
-        # Pad to full size deterministically
-        padding_seed = hashlib.sha3_256(private_key).digest()
-        padding = hashlib.sha3_384(b"PAD" + padding_seed).digest()
-        public_key = (public_key + padding)[:self.key_size]
-        return public_key, private_key
+        seed = secrets.token_bytes(self.key_size)
+        public_key = self._public_from_private(seed)
+        # Private key blob = seed || public key, like real Kyber's sk embedding pk,
+        # so decapsulate never re-derives it
+        return public_key, seed + public_key
+    
+    def _public_from_private(self, private_key: bytes) -> bytes:
+        """Deterministic full-size public key — one SHAKE-128 call (the XOF real Kyber uses)"""
+        return hashlib.shake_128(DOM_PUB + private_key).digest(self.key_size)
+    
+    def _shared_secret(self, ciphertext: bytes, public_key: bytes) -> bytes:
+        return hashlib.shake_128(DOM_SECRET + ciphertext + public_key).digest(32)
     
     def encapsulate(self, public_key: bytes) -> Tuple[bytes, bytes]:
         """
@@ -57,11 +101,15 @@ class LACKyber768:
         Returns:
             (ciphertext, shared_secret)
         """
+        if OQS_AVAILABLE:
+            with oqs.KeyEncapsulation(OQS_KEM) as kem:
+                return kem.encap_secret(public_key)
+        
         # Simplified: Real Kyber uses lattice-based KEM
         ephemeral = secrets.token_bytes(32)
-        ciphertext = hashlib.sha3_384(b"KYBER_ENCAPS" + public_key + ephemeral).digest()
+        ciphertext = hashlib.shake_128(DOM_ENC + public_key + ephemeral).digest(48)
         # Include public_key and ciphertext in secret derivation for consistency
-        shared_secret = hashlib.sha3_256(ciphertext + public_key).digest()
+        shared_secret = self._shared_secret(ciphertext, public_key)
         return ciphertext, shared_secret
     
     def decapsulate(self, private_key: bytes, ciphertext: bytes) -> bytes:
@@ -71,16 +119,18 @@ class LACKyber768:
         Returns:
             shared_secret
         """
+        if OQS_AVAILABLE:
+            with oqs.KeyEncapsulation(OQS_KEM, secret_key=private_key) as kem:
+                return kem.decap_secret(ciphertext)
+        
         # Simplified: Real Kyber recovers using private key algebra
-        # Derive public key from private key (deterministic - same as generate_keypair)
-        public_key = hashlib.sha3_384(b"KYBER_PUB" + private_key).digest()
-        padding_seed = hashlib.sha3_256(private_key).digest()
-        padding = hashlib.sha3_384(b"PAD" + padding_seed).digest()
-        public_key = (public_key + padding)[:self.key_size]
+        # Private key blob is seed || public key (see generate_keypair)
+        if len(private_key) != 2 * self.key_size:
+            raise ValueError(f"Kyber stub private key must be {2 * self.key_size} bytes")
+        public_key = private_key[self.key_size:]
         
         # Use same formula as encapsulate
-        shared_secret = hashlib.sha3_256(ciphertext + public_key).digest()
-        return shared_secret
+        return self._shared_secret(ciphertext, public_key)
 
 
 class LACStealthAddress:
@@ -94,6 +144,10 @@ class LACStealthAddress:
     Sender creates one-time address that only recipient can:
     - Detect (using view key)
     - Spend (using spend key)
+    
+    Derivations use SHA-256 rather than SHA3-256: OpenSSL (behind hashlib)
+    runs SHA-256 on the SHA-NI / ARMv8 SHA instructions, SHA-3 has no
+    commodity hardware support — and scanning hashes every output on chain.
     """
     
     def __init__(self):
@@ -156,7 +210,7 @@ class LACStealthAddress:
         random_scalar = secrets.token_bytes(32)
         
         # Generate transaction public key (for recipient scanning)
-        tx_public_key = hashlib.sha3_256(b"TX_PUB" + random_scalar).digest()
+        tx_public_key = hashlib.sha256(b"TX_PUB" + random_scalar).digest()
         
         # Derive one-time public key (Monero formula)
         # P' = H(r*A)*G + B
@@ -176,14 +230,14 @@ class LACStealthAddress:
     
     def _compute_shared_secret(self, random_scalar: bytes, recipient_view_pub: bytes) -> bytes:
         """Compute shared secret: H(r*A)"""
-        combined = hashlib.sha3_256(random_scalar + recipient_view_pub).digest()
+        combined = hashlib.sha256(random_scalar + recipient_view_pub).digest()
         return combined
     
     def _derive_one_time_public_key(self, shared_secret: bytes, recipient_spend_pub: bytes) -> bytes:
         """Derive one-time public key: H(shared_secret)*G + B"""
         # Simplified: Real Monero uses elliptic curve point addition
-        point_hash = hashlib.sha3_256(b"POINT" + shared_secret).digest()
-        one_time_pub = hashlib.sha3_256(point_hash + recipient_spend_pub).digest()
+        point_hash = hashlib.sha256(b"POINT" + shared_secret).digest()
+        one_time_pub = hashlib.sha256(point_hash + recipient_spend_pub).digest()
         return one_time_pub
     
     def scan_transaction(
@@ -218,6 +272,37 @@ class LACStealthAddress:
         # Check if matches
         return expected_address == one_time_address
     
+    def scan_transactions_batch(
+        self,
+        outputs: Iterable[Dict],
+        recipient_view_priv: bytes,
+        recipient_spend_pub: bytes
+    ) -> List[bool]:
+        """
+        Scan many outputs with one view key (wallet rescan)
+        
+        Same result as scan_transaction per output, with the per-call
+        method dispatch, address formatting and slicing hoisted out of
+        the loop — three SHA-256 calls per output remain.
+        
+        Args:
+            outputs: dicts with 'tx_public_key' and 'one_time_address'
+                     (as returned by create_stealth_output)
+            recipient_view_priv: Recipient's private view key
+            recipient_spend_pub: Recipient's public spend key
+        
+        Returns:
+            list of bool, aligned with outputs
+        """
+        sha256 = hashlib.sha256
+        hits = []
+        for output in outputs:
+            shared_secret = sha256(output['tx_public_key'] + recipient_view_priv).digest()
+            point_hash = sha256(b"POINT" + shared_secret).digest()
+            expected = sha256(point_hash + recipient_spend_pub).hexdigest()
+            hits.append(output['one_time_address'] == "onetime_" + expected)
+        return hits
+    
     def derive_private_key(
         self,
         tx_public_key: bytes,
@@ -242,8 +327,8 @@ class LACStealthAddress:
         
         # Derive one-time private key: x' = H(shared_secret) + b
         # Where b = recipient_spend_priv
-        key_offset = hashlib.sha3_256(b"PRIV" + shared_secret).digest()
-        one_time_priv = hashlib.sha3_256(key_offset + recipient_spend_priv).digest()
+        key_offset = hashlib.sha256(b"PRIV" + shared_secret).digest()
+        one_time_priv = hashlib.sha256(key_offset + recipient_spend_priv).digest()
         
         return one_time_priv
 
@@ -296,8 +381,8 @@ class LACStealthTransaction:
         ciphertext, shared_secret = self.kyber.encapsulate(kyber_pub)
         
         # XOR amount with shared secret (for confidentiality)
-        amount_bytes = str(amount).encode().ljust(32, b'\x00')
-        encrypted_amount = bytes(a ^ b for a, b in zip(amount_bytes, shared_secret))
+        amount_bytes = _AMOUNT.pack(float(amount)) + _AMOUNT_PAD
+        encrypted_amount = _xor_bytes(amount_bytes, shared_secret)
         
         return {
             'one_time_address': one_time_address,
@@ -329,10 +414,9 @@ class LACStealthTransaction:
         shared_secret = self.kyber.decapsulate(recipient_view_priv, kyber_ciphertext)
         
         # XOR to decrypt
-        amount_bytes = bytes(a ^ b for a, b in zip(encrypted_amount, shared_secret))
-        amount_str = amount_bytes.decode().strip('\x00')
+        amount_bytes = _xor_bytes(encrypted_amount, shared_secret)
         
-        return float(amount_str)
+        return _AMOUNT.unpack_from(amount_bytes)[0]
 
 
 # ============================================================================
@@ -0,0 +1,80 @@
+"""
+LAC Zone Kernel Module
+Compiled point-in-zone kernel for bulk Proof-of-Location zone detection
+
+Fuses the four bounds comparisons per (point, zone) pair and parallelizes
+over points. Output is sparse (CSR-style offsets + zone indices) — most
+points hit only a handful of zones, so no N_pt × N_zone matrix is built.
+"""
+
+import numpy as np
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        """No-op stand-in: kernels run as plain Python without numba"""
+        if args and callable(args[0]):
+            return args[0]
+        return lambda fn: fn
+
+
+@njit(parallel=True, cache=True)
+def _count_hits(lats, lons, lat_min, lat_max, lon_min, lon_max, counts):
+    """counts[i] = number of zones containing point i"""
+    for i in prange(lats.shape[0]):
+        lat = lats[i]
+        lon = lons[i]
+        c = 0
+        for j in range(lat_min.shape[0]):
+            if lat_min[j] <= lat <= lat_max[j] and lon_min[j] <= lon <= lon_max[j]:
+                c += 1
+        counts[i] = c
+
+
+@njit(parallel=True, cache=True)
+def _fill_hits(lats, lons, lat_min, lat_max, lon_min, lon_max, offsets, out):
+    """Write the matching zone indices of point i into out[offsets[i]:offsets[i+1]]"""
+    for i in prange(lats.shape[0]):
+        lat = lats[i]
+        lon = lons[i]
+        k = offsets[i]
+        for j in range(lat_min.shape[0]):
+            if lat_min[j] <= lat <= lat_max[j] and lon_min[j] <= lon <= lon_max[j]:
+                out[k] = j
+                k += 1
+
+
+def zone_hits(lats, lons, lat_min, lat_max, lon_min, lon_max):
+    """
+    Zone indices containing each point
+
+    Args:
+        lats, lons: float64 arrays of shape (N,)
+        lat_min, lat_max, lon_min, lon_max: float64 zone bounds, shape (Z,)
+
+    Returns:
+        (offsets, idx): zones of point i are idx[offsets[i]:offsets[i+1]],
+        ascending (same order as the zone table)
+    """
+    lats = np.ascontiguousarray(lats, dtype=np.float64)
+    lons = np.ascontiguousarray(lons, dtype=np.float64)
+    n = lats.shape[0]
+    counts = np.empty(n, dtype=np.int64)
+    _count_hits(lats, lons, lat_min, lat_max, lon_min, lon_max, counts)
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    idx = np.empty(offsets[-1], dtype=np.int64)
+    _fill_hits(lats, lons, lat_min, lat_max, lon_min, lon_max, offsets, idx)
+    return offsets, idx
+
+
+if NUMBA_AVAILABLE:
+    # Compile (or load from cache) at import so the first batch verify isn't slow
+    _one = np.zeros(1, dtype=np.float64)
+    zone_hits(_one, _one, _one, _one, _one, _one)
+    del _one